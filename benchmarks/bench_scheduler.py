@@ -0,0 +1,217 @@
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# Scheduler overhead benchmark, see readme
+#
+#   python3 bench_scheduler.py [-o results.json] [--quick]
+#   micropython bench_scheduler.py          (reduced variant)
+#
+# Prints one JSON object per line: environment, then one per benchmark
+#
+
+import sys
+import gc
+import json
+
+try :
+    import tracemalloc              # python3: allocated bytes per cycle
+except :
+    tracemalloc = None
+
+from poll_looper import PollLooper, PollClock, PollSimClock
+
+MICRO_PYTHON = sys.implementation.name == "micropython"
+
+PLUGIN_COUNTS = (10, 100, 1000, 10000)
+PLUGIN_COUNTS_QUICK = (10, 100)
+MIXES = ("noop", "mixed")
+SIM_CYCLES = 200                    # overhead: simulated clock cycles
+REAL_CYCLES = 100                   # jitter: real clock cycles
+REAL_POLL_MS = 5
+INTERVALS_MS = (10, 50, 100, 1000)  # "mixed": scheduled plugin intervals
+BUSY_LOOPS = 200                    # "mixed": busy plugin work
+
+#---------------------------------------------------------------------------
+# Synthetic plugins
+#---------------------------------------------------------------------------
+class NoopPlugin :
+
+    def poll_it (self) :
+        pass
+
+    def shutdown (self) :
+        pass
+
+# end NoopPlugin
+
+class BusyPlugin :
+
+    def __init__ (self, counter) :
+        self.counter = counter          # [busy polls]
+
+    def poll_it (self) :
+        total = 0
+        for index in range (BUSY_LOOPS) :
+            total += index
+        self.counter[0] += 1
+
+    def shutdown (self) :
+        pass
+
+# end BusyPlugin
+
+def lcg (seed) :
+    #---- Repeatable mix on python3 and micropython
+    return (seed * 1103515245 + 12345) & 0x7FFFFFFF
+
+def build (poller, plugins, mix, counter) :
+    seed = 1
+    for index in range (plugins) :
+        if mix == "noop" :
+            poller.poll_add (NoopPlugin ())
+            continue
+        seed = lcg (seed)
+        plugin = BusyPlugin (counter) if seed % 10 == 0 else NoopPlugin ()
+        if index % 4 == 0 :             # every cycle
+            poller.poll_add (plugin)
+        else :
+            seed = lcg (seed)
+            interval_ms = INTERVALS_MS[seed % len (INTERVALS_MS)]
+            seed = lcg (seed)
+            poller.poll_add (plugin ,
+                             interval_ms = interval_ms ,
+                             delay_ms = seed % interval_ms)
+
+def busy_cost_us (clock) :
+    #---- Calibrated time of one BusyPlugin poll_it
+    plugin = BusyPlugin ([0])
+    start_us = clock.ticks_us ()
+    for _ in range (100) :
+        plugin.poll_it ()
+    return clock.ticks_diff (clock.ticks_us (), start_us) / 100
+
+def alloc_cycles (poller, cycles) :
+    #---- Bytes allocated per cycle, None if it can't be measured
+    #---- micropython: gc disabled, mem_alloc counts every allocation
+    #---- python3: tracemalloc peak above the cycle start memory, freed
+    #----   temporaries are counted (a lower bound of all allocations)
+    if MICRO_PYTHON :
+        gc.collect ()
+        gc.disable ()
+        start = gc.mem_alloc ()
+        for _ in range (cycles) :
+            poller.poll_plugins ()
+            poller.poll_wait ()
+        used = gc.mem_alloc () - start
+        gc.enable ()
+        return used / cycles
+    if tracemalloc is None or not hasattr (tracemalloc, "reset_peak") :
+        return None
+    tracemalloc.start ()
+    used = 0
+    for _ in range (cycles) :
+        start = tracemalloc.get_traced_memory ()[0]
+        tracemalloc.reset_peak ()
+        poller.poll_plugins ()
+        poller.poll_wait ()
+        used += tracemalloc.get_traced_memory ()[1] - start
+    tracemalloc.stop ()
+    return used / cycles
+
+def bench_overhead (plugins, mix, cycles, busy_us) :
+    #---- Simulated clock: no sleep, wall time is the scheduler + plugins
+    wall = PollClock ()
+    counter = [0]
+    poller = PollLooper (REAL_POLL_MS, clock = PollSimClock ())
+    build (poller, plugins, mix, counter)
+    for _ in range (10) :               # warm up
+        poller.poll_plugins ()
+        poller.poll_wait ()
+    counter[0] = 0
+    start_us = wall.ticks_us ()
+    for _ in range (cycles) :
+        poller.poll_plugins ()
+        poller.poll_wait ()
+    elapsed_us = wall.ticks_diff (wall.ticks_us (), start_us)
+    busy_polls = counter[0]
+    alloc = alloc_cycles (poller, cycles)   # own pass, tracing is slow
+    overhead_us = (elapsed_us - busy_polls * busy_us) / cycles
+    return {"cycle_us" : round (elapsed_us / cycles, 3) ,
+            "overhead_us" : round (overhead_us, 3) ,
+            "overhead_us_per_plugin" : round (overhead_us / plugins, 4) ,
+            "busy_polls_per_cycle" : round (busy_polls / cycles, 3) ,
+            "alloc_bytes_per_cycle" : None if alloc is None
+                                      else round (alloc, 1)}
+
+def bench_realtime (plugins, mix, cycles) :
+    #---- Real clock: wake up jitter and overrun rate
+    poller = PollLooper (REAL_POLL_MS, timing = True)
+    build (poller, plugins, mix, [0])
+    poller.poll_init ()
+    for _ in range (cycles) :
+        poller.poll_plugins ()
+        poller.show_timeout = False     # no overrun messages
+        poller.poll_wait ()
+    stats = poller.poll_stats ()
+    return {"jitter_p50_us" : stats["jitter"]["p50_us"] ,
+            "jitter_p99_us" : stats["jitter"]["p99_us"] ,
+            "jitter_max_us" : stats["jitter"]["max_us"] ,
+            "busy_p50_us" : stats["busy"]["p50_us"] ,
+            "overrun_rate" : round (stats["overruns"] / stats["cycles"], 3)}
+
+def main () :
+    quick = MICRO_PYTHON or "--quick" in sys.argv
+    output = None
+    if "-o" in sys.argv :
+        output = sys.argv[sys.argv.index ("-o") + 1]
+    counts = PLUGIN_COUNTS_QUICK if quick else PLUGIN_COUNTS
+    sim_cycles = SIM_CYCLES // 4 if quick else SIM_CYCLES
+    real_cycles = REAL_CYCLES // 2 if quick else REAL_CYCLES
+    clock = PollClock ()
+    busy_us = busy_cost_us (clock)
+    results = [{"environment" : sys.implementation.name ,
+                "version" : ".".join ([str (part) for part
+                                       in sys.implementation.version[:3]]) ,
+                "platform" : sys.platform ,
+                "quick" : quick ,
+                "poll_ms" : REAL_POLL_MS ,
+                "busy_cost_us" : round (busy_us, 3)}]
+    print (json.dumps (results[0]))
+    for mix in MIXES :
+        for plugins in counts :
+            result = {"bench" : "scheduler" ,
+                      "mix" : mix ,
+                      "plugins" : plugins ,
+                      "sim_cycles" : sim_cycles ,
+                      "real_cycles" : real_cycles}
+            result.update (bench_overhead (plugins, mix, sim_cycles, busy_us))
+            result.update (bench_realtime (plugins, mix, real_cycles))
+            results.append (result)
+            print (json.dumps (result))
+            gc.collect ()
+    if output is not None :
+        with open (output, "w") as output_file :
+            json.dump (results, output_file)
+
+main ()
@@ -36,6 +36,7 @@ from pi_shutdown_timer import ShutdownTimer
 from pi_ledblink import LEDBlink
 from pi_template import PlugInTemplate
 from pi_garbage_collect import GarbageCollect
+from pi_sampler import SensorSampler
 if MICRO_PYTHON :               # micropython only
     from pi_watchdog import Watchdog
 
@@ -54,6 +55,7 @@ poller.poll_add (LEDBlink (poller))
 poller.poll_add (PlugInTemplate (poller ,
                                 poll_seconds = 5))
 poller.poll_add (GarbageCollect (poller))
+poller.poll_add (SensorSampler (poller))
                                  
 if MICRO_PYTHON :               # micropython only
     poller.poll_add (Watchdog (poller))
@@ -1,9 +1,10 @@
 #---------------------------------------------------------------------------
 # GarbageCollect
+#   o The poller runs garbage collection in the slack time between poll
+#     cycles (gc_enable), a collection never delays a plugin
+#   o Shows the gc statistics every poll_seconds
 #---------------------------------------------------------------------------
 
-import gc
-
 class GarbageCollect:
     def __init__(self,
                 poller ,
@@ -13,6 +14,7 @@ class GarbageCollect:
         self.active_interval_ms = poller.seconds_to_ms (poll_seconds)
         self.active_next_ms \
             = self.poller.active_next_ms (self.active_interval_ms)
+        poller.gc_enable (interval_ms = self.active_interval_ms)
 
     def poll_it (self) :
         #print (__class__, "poll_it")
@@ -20,12 +22,13 @@ class GarbageCollect:
             return
         self.active_next_ms \
             = self.poller.active_next_ms (self.active_interval_ms)
-        print (__class__, "active")
-        gc.collect ()
-        self.poller.allow_timeout ()
+        gc_stats = self.poller.gc_stats ()
+        print (__class__, "active: full:", gc_stats["full"] ,
+               "deferred:", gc_stats["deferred"] ,
+               "max pause us:", gc_stats["pause"]["max_us"])
 
     def shutdown (self) :
         print (__class__, "shutdown")
         #---- Shutdown code goes here
 
-# end PlugInTemplate #
\ No newline at end of file
+# end GarbageCollect #
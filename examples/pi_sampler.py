@@ -0,0 +1,41 @@
+#---------------------------------------------------------------------------
+# SensorSampler - PollSampler example
+#   o Reads a (simulated) sensor every poll cycle, keeps the average of
+#     every 4 readings in a preallocated ring buffer
+#   o process shows the statistics of each batch of new samples
+#---------------------------------------------------------------------------
+
+import math
+
+from poll_sampler import PollSampler
+
+class SensorSampler (PollSampler) :
+    def __init__(self,
+                poller ,
+                decimate = 4 ,
+                batch = 25) :
+        print (__class__, "init")
+        super ().__init__ (poller ,
+                           size = 100 ,
+                           typecode = 'f' ,
+                           decimate = decimate ,
+                           average = True ,
+                           batch = batch)
+        self.readings = 0
+        #---- Initialize ADC here
+
+    def read_sample (self) :
+        #---- Read ADC here, e.g. adc.read_u16 ()
+        self.readings += 1
+        return 20.0 + 5.0 * math.sin (self.readings / 20.0)
+
+    def process (self, first, second) :
+        count = len (first) + len (second)
+        low, high, mean = self.window_stats (count)
+        print (__class__, "samples:", count ,
+               "min: %.2f max: %.2f mean: %.2f" % (low, high, mean))
+
+    def shutdown (self) :
+        print (__class__, "shutdown")
+
+# end SensorSampler #
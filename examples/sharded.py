@@ -0,0 +1,76 @@
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# python3 only: device plugins split across worker processes (PollShards)
+#
+
+from poll_shard import PollShards
+
+from pi_shutdown_timer import ShutdownTimer
+
+DEVICES = 200
+WORKERS = 4
+POLL_INTERVAL = 100             # milliseconds
+RUN_SECONDS = 5
+
+#---------------------------------------------------------------------------
+# Device - Simulated device, publishes a reading every second
+#---------------------------------------------------------------------------
+class Device :
+
+    def __init__ (self, poller, device_id) :
+        self.poller = poller
+        self.device_id = device_id
+        self.reading = 0
+
+    def poll_it (self) :
+        self.reading += 1
+        #---- Poll device here
+        self.poller.message_set_entry ("devices" ,
+                                       self.device_id ,
+                                       self.reading)
+
+    def shutdown (self) :
+        pass
+
+# end Device
+
+#---------------------------------------------------------------------------
+# main
+#---------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+    shards = PollShards (POLL_INTERVAL ,
+                         workers = WORKERS ,
+                         timing = True)
+    for device_id in range (DEVICES) :
+        shards.poll_add (Device, args = (device_id,), interval_ms = 1000)
+    shards.poll_add (ShutdownTimer ,
+                     kwargs = {"seconds" : RUN_SECONDS} ,
+                     shard = 0)
+    shards.poll_start ()
+    stats = shards.poll_stats ()
+    print ("devices:", len (shards.message_data.get ("devices", {})) - 1 ,
+           "cycles:", stats["cycles"] ,
+           "overruns:", stats["overruns"])
@@ -39,6 +39,10 @@ CROSSWALK_PIN = None
 #CROSSWALK_PIN = 35               # Button pin
 USE_ASYNCIO = False
 #USE_ASYNCIO = True              # See readme
+SIMULATED_HOURS = 0              # > 0: fast forward run, see readme
+#SIMULATED_HOURS = 24
+CHECKPOINT_FILE = None           # warm restart, see readme
+#CHECKPOINT_FILE = "trafficlights.chk"
 
 #---- Example module:
 POLL_INTERVAL_MS = 100            # milliseconds
@@ -51,6 +55,7 @@ from poll_looper import PollLooper
 #   o Crossing request ony affects the green light state
 #     If the second_counter > dont_walk_start_seconds
 #       set the second_counter to dont_walk_start_seconds
+#   o Resumes from a restored "state" (checkpoint_enable)
 #-------------------------------------------------------------------------------
 
 class TL_Controller :
@@ -77,12 +82,17 @@ class TL_Controller :
                                              "walk" : "WK" ,
                                              "dontwalk" : "DW"
                                              })
-        poller.message_set ("state" ,
-                            {"light_on" : self.display ["red"] ,
-                            "walk_display" : self.display ["dontwalk"] ,
-                            "crossing_request" : False})
+        controller = poller.message_get ("controller")
+        if "next_light_on" in controller :          # warm restart
+            self.second_counter = controller ["second_counter"]
+            self.next_light_on = controller ["next_light_on"]
+        else :
+            poller.message_set ("state" ,
+                                {"light_on" : self.display ["red"] ,
+                                "walk_display" : self.display ["dontwalk"] ,
+                                "crossing_request" : False})
+            self.next_light_on = self.display ["red"]
         self.state = poller.message_get ("state")
-        self.next_light_on = self.display ["red"]
 
     def poll_it (self) :
         #print (__class__, "poll_it")
@@ -91,6 +101,8 @@ class TL_Controller :
         self.active_next_ms \
             = self.poller.active_next_ms (self.active_interval_ms)
         #print (__class__, "poll_it: active")           # every second
+        light_on = self.state ["light_on"]
+        walk_display = self.state ["walk_display"]
         self.state ["light_on"] = self.next_light_on
         if self.state ["light_on"] == self.display["red"] : # "red" state
             if self.second_counter <= 0 :               # First cycle
@@ -127,6 +139,12 @@ class TL_Controller :
                     self.next_light_on = self.display["red"]  # switch
         else :
             print ("light_on:", self.state ["light_on"])
+        if self.state ["light_on"] != light_on \
+                or self.state ["walk_display"] != walk_display :
+            self.poller.message_touch ("state")     # wakes up TL_View
+        self.poller.message_set ("controller" ,     # checkpointed
+                                 {"second_counter" : self.second_counter ,
+                                  "next_light_on" : self.next_light_on})
 
     def crossing_request (self) :           # Called by interrupt handler
         #print (__class__, "crossing_request")
@@ -163,6 +181,7 @@ class TL_CrossingRequest :
                           pin = None) :     # Called by interrupt handler
         #print (__class__, "crossing_request")
         self.button_pushed = True
+        self.poller.wake ()             # poll now, don't wait for the cycle
 
     def shutdown (self) :
         pass
@@ -171,6 +190,7 @@ class TL_CrossingRequest :
 
 #-------------------------------------------------------------------------------
 # TL_View - Displays current stop light and walk/dontwalk state
+#   o Subscribed to "state", only polled when TL_Controller changes it
 #   o Only shows display when it changes
 #   o In a "real world" implementation this class would turn on/off LEDs
 #-------------------------------------------------------------------------------
@@ -208,34 +228,40 @@ if MACHINE_FREQ > 0 :
     freq (MACHINE_FREQ)
     print ("machine.freq:", freq())
 
-poller = PollLooper (POLL_INTERVAL_MS,
-                     use_asyncio = USE_ASYNCIO)
+if SIMULATED_HOURS > 0 :
+    from poll_looper import PollSimClock
+    from pi_shutdown_timer import ShutdownTimer
+    poller = PollLooper (POLL_INTERVAL_MS,
+                         clock = PollSimClock ())
+    poller.poll_add (ShutdownTimer (poller ,
+                                    hours = SIMULATED_HOURS))
+else :
+    poller = PollLooper (POLL_INTERVAL_MS,
+                         use_asyncio = USE_ASYNCIO)
+
+if CHECKPOINT_FILE is not None :
+    #---- Before the plugins are created: restores message_data
+    if poller.checkpoint_enable (CHECKPOINT_FILE, interval_ms = 5000) :
+        print ("Restored", CHECKPOINT_FILE)
 
 tl_controller = TL_Controller (poller)
 crossing_request = TL_CrossingRequest (poller)
 
 poller.poll_add (tl_controller)
 poller.poll_add (crossing_request)
-poller.poll_add (TL_View (poller))
+poller.poll_add (TL_View (poller) ,
+                 subscribe = ("state",))
 
 if USE_ASYNCIO :
-    import uasyncio as asyncio
-    from primitives import Pushbutton
-    async def poll_plugins () :
-        gc.collect ()
-        poller.poll_init ()        # Reset poll start time
-        while poller.running () :
-            #print ("poll_plugins: entry:")
-            #---- polls plugins added to poll-looper
-            poller.poll_plugins ()
-            #---- get wait time
-            sleep_ms = poller.poll_wait ()
-            #---- poll_wait returns ms to wait for next poll cycle
-            await asyncio.sleep_ms (sleep_ms)
-        print ("poller: exit")
+    try :
+        import uasyncio as asyncio
+    except :
+        import asyncio
     async def main() :
-        asyncio.create_task (poll_plugins ())
+        #---- polls plugins added to poll-looper
+        asyncio.create_task (poller.poll_start_async ())
         if CROSSWALK_PIN != None :
+            from primitives import Pushbutton
             crosswalk_pin = Pin (CROSSWALK_PIN, Pin.IN, Pin.PULL_UP)
             crosswalk_button = Pushbutton (crosswalk_pin)
             crosswalk_button.press_func (tl_controller.crossing_request, ()) 
@@ -0,0 +1,367 @@
+#
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# poll_bridge.py - Mirror message_data topics between PollLooper nodes
+#
+# class PollBridge
+#   methods:
+#     __init__
+#     poll_it - Apply received updates, send the changed keys
+#     resync - Send all keys of all topics in the next poll_it
+#     stats - Returns packet counters
+#     shutdown - Close the transport
+#
+# class PollBridgeUDP - UDP transport (peers list)
+# class PollBridgePipe - Local datagram pipe transport (python3, testing)
+#
+################################################################################
+#
+
+try :
+    import usocket as socket
+except :
+    import socket
+
+try :
+    import uos as os
+except :
+    import os
+
+try :
+    import ustruct as struct
+except :
+    import struct
+
+from poll_looper import checkpoint_encode, checkpoint_encode_key, \
+                        checkpoint_decode
+
+BRIDGE_MAGIC = b"PB"
+BRIDGE_VERSION = 1
+BRIDGE_HEADER = "<2sBBIII"          # magic, version, flags, node, epoch, seq
+BRIDGE_HEADER_SIZE = struct.calcsize (BRIDGE_HEADER)
+BRIDGE_FULL = 0x01                  # flags: all keys (resync)
+BRIDGE_LOCAL_KEYS = ("last_update_ms",)     # set by each node's message_set
+BRIDGE_MISSING = object ()
+
+#---------------------------------------------------------------------------
+# PollBridgeUDP - Non blocking UDP socket, packets are sent to all peers
+#---------------------------------------------------------------------------
+class PollBridgeUDP :
+
+    def __init__ (self ,
+                  port ,
+                  peers ,               # [(host, port), ...]
+                  host = "0.0.0.0" ,
+                  max_packet = 1472) :
+        self.max_packet = max_packet
+        self.peers = [socket.getaddrinfo (peer[0], peer[1])[0][-1]
+                      for peer in peers]
+        self.sock = socket.socket (socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind (socket.getaddrinfo (host, port)[0][-1])
+        self.sock.setblocking (False)
+        self.fileobj = self.sock        # io_register
+
+    def send (self, data) :
+        #---- Returns the number of peers the packet couldn't be sent to
+        errors = 0
+        for address in self.peers :
+            try :
+                self.sock.sendto (data, address)
+            except OSError :
+                errors += 1             # buffer full, peer unreachable
+        return errors
+
+    def recv (self) :
+        #---- Returns a packet, None if there is none
+        try :
+            return self.sock.recv (self.max_packet)
+        except OSError :
+            return None
+
+    def close (self) :
+        self.sock.close ()
+
+# end PollBridgeUDP
+
+#---------------------------------------------------------------------------
+# PollBridgePipe - Local datagram socket pair, e.g. two PollLooper's in
+#   one process (tests) or a parent and a child process. python3 only.
+#   a, b = bridge_pipe_pair ()
+#---------------------------------------------------------------------------
+class PollBridgePipe :
+
+    def __init__ (self, sock, max_packet = 65536) :
+        self.max_packet = max_packet
+        self.sock = sock
+        self.sock.setblocking (False)
+        self.fileobj = sock
+
+    def send (self, data) :
+        try :
+            self.sock.send (data)
+            return 0
+        except OSError :
+            return 1
+
+    def recv (self) :
+        try :
+            return self.sock.recv (self.max_packet)
+        except OSError :
+            return None
+
+    def close (self) :
+        self.sock.close ()
+
+# end PollBridgePipe
+
+def bridge_pipe_pair () :
+    sock_a, sock_b = socket.socketpair (socket.AF_UNIX, socket.SOCK_DGRAM)
+    return (PollBridgePipe (sock_a), PollBridgePipe (sock_b))
+
+#---------------------------------------------------------------------------
+# PollBridge - Mirrors the selected message_data topics (DictIDs) between
+#   PollLooper nodes
+#   o Once per poll_it the keys changed since the last send (message_version,
+#     value compare) are batched into packets of at most max_packet bytes,
+#     encoded with checkpoint_encode. Updates applied from other nodes are
+#     not sent back.
+#   o Packets carry node id, epoch (per start) and sequence number, older
+#     or duplicate packets of a node are dropped. A new epoch (node restart)
+#     is accepted and answered with a resync.
+#   o Lost packets: all keys are sent every resync_ms
+#   o A key/value that doesn't fit in max_packet isn't sent (oversize)
+#   o Non blocking: packets that can't be sent are dropped (counted), the
+#     next resync repairs the other nodes. At most max_recv packets are
+#     read per poll_it. The transport is registered with io_register.
+#   o Keys are only added/changed, never deleted. Concurrent changes of a
+#     key on two nodes: the last received wins. Values are compared with
+#     ==, replace list/dict values instead of changing them in place.
+#---------------------------------------------------------------------------
+class PollBridge :
+
+    def __init__ (self ,
+                  poller ,
+                  transport ,           # PollBridgeUDP, PollBridgePipe
+                  topics ,              # mirrored DictIDs
+                  node_id = None ,      # unique per node, default: random
+                  resync_ms = 5000 ,
+                  max_recv = 16) :
+        self.poller = poller
+        self.transport = transport
+        self.topics = list (topics)
+        self.topic_set = set (topics)
+        if node_id is None :
+            node_id = self.random32 ()
+        self.node_id = node_id & 0xFFFFFFFF
+        self.epoch = self.random32 ()
+        self.seq = 0
+        self.resync_ms = resync_ms
+        self.resync_last_ms = poller.get_current_time_ms ()
+        self.resync_now = True          # first poll_it: full state
+        self.max_recv = max_recv
+        self.max_packet = transport.max_packet
+        self.versions = {}              # topic : message_version sent
+        self.sent = {}                  # topic : {key : value sent}
+        self.nodes = {}                 # node : (epoch, last seq)
+        self.registered = False
+        self.counters = {"sent" : 0 ,
+                         "send_errors" : 0 ,
+                         "received" : 0 ,
+                         "applied" : 0 ,
+                         "stale" : 0 ,
+                         "bad" : 0 ,
+                         "oversize" : 0 ,
+                         "resyncs" : 0}
+
+    def random32 (self) :
+        try :
+            return struct.unpack ("<I", os.urandom (4))[0]
+        except :
+            return self.poller.clock.ticks_us () & 0xFFFFFFFF
+
+    def poll_it (self) :
+        poller = self.poller
+        if not self.registered :
+            self.registered = True
+            if getattr (self.transport, "fileobj", None) is not None :
+                poller.io_register (self, self.transport.fileobj)
+        for _ in range (self.max_recv) :
+            data = self.transport.recv ()
+            if data is None :
+                break
+            self.receive (data)
+        full = self.resync_now \
+                or (self.resync_ms > 0
+                    and poller.elapsed_ms (self.resync_last_ms)
+                        >= self.resync_ms)
+        if full :
+            self.resync_now = False
+            self.resync_last_ms = poller.get_current_time_ms ()
+            self.counters["resyncs"] += 1
+        self.send_changes (full)
+
+    def resync (self) :
+        self.resync_now = True
+
+    def send_changes (self, full) :
+        #---- Changed keys of all topics, packets of max_packet bytes
+        poller = self.poller
+        packet = None
+        for topic in self.topics :
+            version = poller.message_version (topic)
+            if not full and self.versions.get (topic) == version :
+                continue
+            self.versions[topic] = version
+            data = poller.message_snapshot (topic)
+            if data is None :
+                continue
+            if topic not in self.sent :
+                self.sent[topic] = {}
+            sent = self.sent[topic]
+            count = 0                   # pairs of the topic record
+            count_pos = 0
+            topic_head = bytearray ()   # topic record: topic, count, pairs
+            checkpoint_encode (topic_head, topic)
+            checkpoint_encode (topic_head, 0)
+            pair = bytearray ()
+            for key in data :
+                if key in BRIDGE_LOCAL_KEYS :
+                    continue
+                value = data[key]
+                if not full and sent.get (key, BRIDGE_MISSING) == value :
+                    continue
+                del pair[:]
+                try :
+                    checkpoint_encode_key (pair, key)
+                    checkpoint_encode (pair, value)
+                except TypeError :
+                    continue            # not encodable, not mirrored
+                if BRIDGE_HEADER_SIZE + len (topic_head) + len (pair) \
+                        > self.max_packet :
+                    self.counters["oversize"] += 1  # doesn't fit a packet
+                    continue
+                sent[key] = value
+                size = len (pair)
+                if count == 0 :
+                    size += len (topic_head)
+                if packet is not None \
+                        and len (packet) + size > self.max_packet :
+                    if count > 0 :
+                        struct.pack_into ("<i", packet, count_pos + 1, count)
+                    self.send_packet (packet, full)
+                    packet = None
+                    count = 0
+                if packet is None :
+                    packet = bytearray (BRIDGE_HEADER_SIZE)
+                if count == 0 :
+                    packet.extend (topic_head)
+                    count_pos = len (packet) - 5    # "i" + int32
+                packet.extend (pair)
+                count += 1
+            if count > 0 :
+                struct.pack_into ("<i", packet, count_pos + 1, count)
+        if packet is not None :
+            self.send_packet (packet, full)
+
+    def send_packet (self, packet, full) :
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        struct.pack_into (BRIDGE_HEADER, packet, 0 ,
+                          BRIDGE_MAGIC, BRIDGE_VERSION ,
+                          BRIDGE_FULL if full else 0 ,
+                          self.node_id, self.epoch, self.seq)
+        self.counters["sent"] += 1
+        self.counters["send_errors"] += self.transport.send (packet)
+
+    def receive (self, data) :
+        counters = self.counters
+        counters["received"] += 1
+        try :
+            magic, version, flags, node, epoch, seq \
+                = struct.unpack_from (BRIDGE_HEADER, data, 0)
+        except Exception :
+            counters["bad"] += 1
+            return
+        if magic != BRIDGE_MAGIC or version != BRIDGE_VERSION :
+            counters["bad"] += 1
+            return
+        if node == self.node_id :
+            return                      # own packet (broadcast, loop)
+        last = self.nodes.get (node)
+        if last is not None and last[0] == epoch :
+            if not 0 < ((seq - last[1]) & 0xFFFFFFFF) < 0x80000000 :
+                counters["stale"] += 1  # older or duplicate
+                return
+        else :
+            self.resync_now = True      # new or restarted node: our state
+        self.nodes[node] = (epoch, seq)
+        try :
+            updates = self.decode (data)
+        except Exception :
+            counters["bad"] += 1
+            return
+        poller = self.poller
+        for topic in updates :
+            values = updates[topic]
+            sent = self.sent.get (topic)
+            if sent is None :
+                sent = {}
+                self.sent[topic] = sent
+            for key in values :         # not sent back
+                sent[key] = values[key]
+            poller.message_set (topic, values)
+            counters["applied"] += 1
+
+    def decode (self, data) :
+        #---- {topic : {key : value}} of the mirrored topics
+        updates = {}
+        pos = BRIDGE_HEADER_SIZE
+        end = len (data)
+        while pos < end :
+            topic, pos = checkpoint_decode (data, pos)
+            count, pos = checkpoint_decode (data, pos)
+            values = {}
+            for _ in range (count) :
+                key, pos = checkpoint_decode (data, pos)
+                values[key], pos = checkpoint_decode (data, pos)
+            if topic in self.topic_set :
+                if topic in updates :
+                    updates[topic].update (values)
+                else :
+                    updates[topic] = values
+        return updates
+
+    def stats (self) :
+        stats = dict (self.counters)
+        stats["node_id"] = self.node_id
+        stats["nodes"] = len (self.nodes)
+        return stats
+
+    def shutdown (self) :
+        if self.registered and getattr (self.transport, "fileobj", None) \
+                is not None :
+            self.poller.io_unregister (self, self.transport.fileobj)
+        self.transport.close ()
+
+# end PollBridge
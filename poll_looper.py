@@ -30,18 +30,70 @@
 #     __init__
 #     poll_init - Initialize poll timing
 #     poll_add - Add plugin to poll loop
+#     poll_remove - Remove plugin from poll loop (next poll cycle)
+#     poll_lookup - Returns the PollEntry of a plugin name
+#     poll_tagged - Returns the PollEntry's of a tag
+#     poll_schedule - Set next due time of a scheduled plugin
 #     poll_start - Start polling loop
+#     poll_start_async - Start polling loop as an asyncio coroutine
 #     poll_wait - Sleep between poll loops
+#     poll_plugins - Poll every cycle plugins and due scheduled plugins
+#     poll_plugins_async - poll_plugins, then await async plugins
+#     poll_await - Await an async plugin poll_it, fault isolation
+#     poll_offload_collect - Apply finished blocking plugin results
+#     poll_tasks_run - Resume generator poll_it tasks for a slice
 #     running - Returns True if poll is running
 #     shutdown - Sets running status to False
+#     wake - Ends the poll_wait sleep, IRQ/signal/thread safe
+#     group_add - Add a rate group (own interval, plugins and thread)
+#     group_start - Start the rate group threads
+#     group_stop - Stop this loop and its rate groups
+#     io_register - Poll plugin when a socket/stream is ready
+#     io_unregister - Remove io_register
+#     io_ready - Returns the ready events of a registered socket/stream
 #     seconds_to_ms - Computes seconds to milliseconds
 #     minutes_to_ms - Computes minutes to milliseconds
 #     hours_to_ms - Computes hours to milliseconds
 #     get_current_time_ms - Returns current millisecond counter
+#     get_current_time_us - Returns current microsecond counter
+#     elapsed_ms - Returns ms between a ms counter and the current time
+#     active_next_ms / active_next_us - Returns next active time
+#     active_now / active_now_us - Returns True if next active time reached
 #     allow_timeout - Ignore (no error) poll timeout
+#     overrun_policy - Set poll overrun handling: reanchor, skip, catchup
+#     budget_set - Set plugin time budget per cycle (priority classes)
+#     slice_limit - Limit generator task slices per cycle
+#     poll_missed - Returns missed deadlines and lateness of a plugin
+#     fault_policy - Set plugin exception handling: backoff, breaker
+#     fault_reset - Enable a backed off or disabled plugin again
+#     fault_stats - Returns plugin failure counts
+#     timing_enable - Enable/disable cycle and plugin timing
+#     poll_stats - Returns cycle and plugin timing statistics
+#     checkpoint_enable - Restore and periodically save message_data
+#     checkpoint_save - Write a message_data checkpoint now
+#     checkpoint_stats - Returns checkpoint writes and size
+#     trace_enable - Record cycle and plugin events in a binary trace
+#     trace_disable - Stop tracing, save the trace file
+#     trace_save - Write the trace to a file
+#     adaptive_enable - Adapt poll interval to plugin activity
+#     adaptive_disable - Restore fixed poll interval
+#     adaptive_stats - Returns adaptive interval state and transitions
+#     activity - Plugin reports activity (adaptive poll interval)
+#     gc_enable - Run garbage collection in the poll_wait slack time
+#     gc_disable - Stop slack time garbage collection
+#     gc_stats - Returns garbage collection statistics
 #     message_set - Set global data
 #     message_get - Get global data
+#     message_set_entry - Set global dictionary entry
 #     message_get_entry - Get global dictionary entry
+#     message_snapshot - Get a consistent copy of global data
+#     message_touch - Mark global data changed (changed in place)
+#     message_version - Returns global data change counter
+#     message_changed - Returns True if changed since version
+#     message_subscribe - Poll plugin when global data changes
+#     message_history - Keep the last values of global data entries
+#     message_history_get - Returns the PollHistory of an entry
+#     message_stale - Returns True if global data wasn't set for a time
 #
 ################################################################################
 #
@@ -53,24 +105,1254 @@ except :
     from types import MethodType
     import time as time
     def ticks_ms(self):
-        return int (round (time.time () * 1000))
+        return time.perf_counter_ns () // 1000000     # monotonic
+    def ticks_us(self):
+        return time.perf_counter_ns () // 1000
     def ticks_add(self, ms_1, ms_2):
         return ms_1 + ms_2
     def ticks_diff(self, ms_1, ms_2):
         return ms_1 - ms_2
     def sleep_ms (self, ms_1) :
         return time.sleep (ms_1 / 1000)
+    def sleep_us (self, us_1) :
+        return time.sleep (us_1 / 1000000)
     time.ticks_ms = MethodType (ticks_ms, time)
+    time.ticks_us = MethodType (ticks_us, time)
     time.ticks_add = MethodType (ticks_add, time)
     time.ticks_diff = MethodType (ticks_diff, time)
     time.sleep_ms = MethodType (sleep_ms, time)
+    time.sleep_us = MethodType (sleep_us, time)
 
 try :
     import uasyncio as asyncio
 except :
-    pass
+    try :
+        import asyncio
+    except :
+        asyncio = None
+
+try :
+    from inspect import iscoroutinefunction
+except :
+    def iscoroutinefunction (func) :
+        return False                # micropython: use poll_add is_async
+
+try :
+    import os
+except :
+    os = None                       # no pipe, wake sets a flag only
+
+try :
+    import select
+except :
+    try :
+        import uselect as select
+    except :
+        select = None
+
+try :
+    import uheapq as heapq
+except :
+    import heapq
+
+from array import array
+
+try :
+    import _thread
+except :
+    _thread = None                  # blocking plugins are run inline
+
+try :
+    import ustruct as struct
+except :
+    import struct
+STRUCT_ERROR = getattr (struct, "error", ValueError)    # micropython: none
+
+try :
+    import mmap
+except :
+    mmap = None                     # trace buffer in memory, see save
 
 import gc
+GC_GENERATIONS = hasattr (gc, "get_count")  # python3: generational gc
+
+POLL_REBASE_US = 1 << 28            # poll_elapsed_us rebase, keeps small ints
+POLL_SLEEP_MAX_US = 1 << 28         # tickless sleep, < half the ticks period
+POLL_STOP_WAIT_MS = 5000            # shutdown: wait for blocking plugins
+
+#---- Overrun policies, see PollLooper overrun_policy
+OVERRUN_REANCHOR = "reanchor"       # next poll interval starts now
+OVERRUN_SKIP = "skip"               # keep the phase, skip missed polls
+OVERRUN_CATCHUP = "catchup"         # poll the missed polls right away
+
+#---- Priority classes, see PollLooper poll_add and budget_set
+PRIORITY_CRITICAL = 0               # always polled, in poll_add order
+PRIORITY_NORMAL = 1                 # deferred when the cycle budget is spent
+PRIORITY_LOW = 2                    # polled after PRIORITY_NORMAL plugins
+
+GENERATOR_TYPE = type ((lambda : (yield)) ())   # poll_it work slices
+
+def ms_to_us (ms) :
+    return int (round (ms * 1000))  # ms may be a decimal number
+
+#---------------------------------------------------------------------------
+# PollClock - Microsecond clock backend
+#   o micropython: ticks_us, wraps, always use ticks_add/ticks_diff
+#   o python3: perf_counter_ns (see time shim above), monotonic
+#   o sleep_us sleeps short by the measured average oversleep and busy
+#     waits the rest (max spin_us), this keeps sub millisecond poll
+#     intervals accurate. spin_us = 0: plain sleep.
+#   o With a PollWaker the sleep ends when wake is called, returns True
+#   o Replace with any object with the same methods, see PollLooper clock
+#---------------------------------------------------------------------------
+class PollClock :
+
+    def __init__ (self, spin_us = 1000) :
+        self.spin_us = spin_us
+        self.sleep_lag_us = 0           # average oversleep
+
+    def ticks_ms (self) :
+        return time.ticks_ms ()
+    def ticks_us (self) :
+        return time.ticks_us ()
+    def ticks_add (self, ticks, delta) :
+        return time.ticks_add (ticks, delta)
+    def ticks_diff (self, ticks_1, ticks_2) :
+        return time.ticks_diff (ticks_1, ticks_2)
+
+    def sleep_us (self, sleep_us, waker = None) :
+        if waker is not None and waker.woken () :
+            return True
+        if sleep_us <= 0 :
+            return False
+        if self.spin_us <= 0 :
+            if waker is None :
+                time.sleep_us (sleep_us)
+                return False
+            waker.wait_us (sleep_us)
+            return waker.woken ()
+        start_us = time.ticks_us ()
+        end_us = time.ticks_add (start_us, sleep_us)
+        coarse_us = sleep_us - self.sleep_lag_us
+        if coarse_us > 0 :
+            if waker is None :
+                time.sleep_us (coarse_us)
+            else :
+                waker.wait_us (coarse_us)
+                if waker.woken () :
+                    return True
+            lag_us = time.ticks_diff (time.ticks_us (), start_us) - coarse_us
+            if lag_us < 0 :
+                lag_us = 0
+            self.sleep_lag_us += (lag_us - self.sleep_lag_us) // 8
+            if self.sleep_lag_us > self.spin_us :
+                self.sleep_lag_us = self.spin_us
+            elif self.sleep_lag_us < 0 :
+                self.sleep_lag_us = 0
+        while time.ticks_diff (end_us, time.ticks_us ()) > 0 :
+            if waker is not None and waker.flag :
+                return waker.woken ()
+        return False                    # spin the remaining time
+
+# end PollClock
+
+#---------------------------------------------------------------------------
+# PollSimClock - Simulated clock for fast forward and repeatable runs
+#   o sleep_us advances the simulated time instead of sleeping, plugins
+#     take no simulated time unless advance_us is called
+#   o ticks wrap like micropython ticks_us (period), ticks_ms follows
+#     the simulated time
+#   o PollLooper (clock = PollSimClock ())
+#---------------------------------------------------------------------------
+SIM_TICKS_PERIOD = 1 << 30
+
+class PollSimClock :
+
+    def __init__ (self ,
+                  start_us = 0 ,
+                  period = SIM_TICKS_PERIOD) :
+        self.ticks_mask = period - 1
+        self.ticks_half = period // 2
+        self.now_us = start_us & self.ticks_mask
+        self.elapsed_us = 0             # Simulated time, doesn't wrap
+        self.spin_us = 0
+
+    def ticks_ms (self) :
+        return time.ticks_add (0, self.elapsed_us // 1000)
+    def ticks_us (self) :
+        return self.now_us
+    def ticks_add (self, ticks, delta) :
+        return (ticks + delta) & self.ticks_mask
+    def ticks_diff (self, ticks_1, ticks_2) :
+        return ((ticks_1 - ticks_2 + self.ticks_half) & self.ticks_mask) \
+                    - self.ticks_half
+
+    def sleep_us (self, sleep_us, waker = None) :
+        if waker is not None and waker.woken () :
+            return True                 # wake before the sleep only
+        self.advance_us (sleep_us)
+        return False
+    def advance_us (self, delta_us) :
+        #---- Also used to simulate time spent by a plugin
+        if delta_us > 0 :
+            self.now_us = (self.now_us + delta_us) & self.ticks_mask
+            self.elapsed_us += delta_us
+
+# end PollSimClock
+
+#---------------------------------------------------------------------------
+# PollWaker - Ends the poll_wait sleep early, waits for I/O readiness
+#   o wake: only sets a flag (micropython IRQ safe) and on python3 writes
+#     to a pipe (thread and signal handler safe)
+#   o register: objects with fileno () (sockets, streams) or fds, the
+#     sleep ends when one is ready (POLL_READ/POLL_WRITE), ready holds the
+#     events until the next poll_wait
+#   o wait_us: python3 waits in select on the pipe and the registered
+#     objects. Otherwise (micropython, windows) the wait is done in
+#     WAKE_SLICE_US slices checking the flag, the registered objects are
+#     checked with select.poll (micropython) or select.select
+#---------------------------------------------------------------------------
+WAKE_SLICE_US = 1000
+POLL_READ = 0x0001                  # select.POLLIN
+POLL_WRITE = 0x0004                 # select.POLLOUT
+
+class PollWaker :
+
+    def __init__ (self) :
+        self.flag = False
+        self.pipe_r = None
+        self.pipe_w = None
+        self.io = {}                    # registered: events
+        self.ready = {}                 # ready: events
+        self.io_read = []               # select lists
+        self.io_write = []
+        self.io_poll = None             # select.poll, micropython
+        self.io_fds = {}                # fd : registered, select.poll
+        if os is not None and hasattr (os, "pipe") \
+                and getattr (os, "name", "") != "nt" :   # select: no pipes
+            try :
+                self.pipe_r, self.pipe_w = os.pipe ()
+                os.set_blocking (self.pipe_r, False)
+                os.set_blocking (self.pipe_w, False)
+                self.io_read.append (self.pipe_r)
+            except :
+                self.pipe_r = None
+                self.pipe_w = None
+        if self.pipe_r is None and select is not None \
+                and hasattr (select, "poll") :
+            self.io_poll = select.poll ()
+
+    def wake (self) :
+        self.flag = True
+        if self.pipe_w is not None :
+            try :
+                os.write (self.pipe_w, b"w")
+            except :
+                pass                    # pipe full, already woken
+
+    def woken (self) :
+        #---- Returns and clears the flag
+        if not self.flag :
+            return False
+        self.flag = False
+        if self.pipe_r is not None :
+            try :
+                while os.read (self.pipe_r, 64) :
+                    pass
+            except :
+                pass                    # empty
+        return True
+
+    def register (self, fileobj, events = POLL_READ) :
+        self.unregister (fileobj)
+        self.io[fileobj] = events
+        if self.io_poll is not None :
+            self.io_poll.register (fileobj, events)
+            try :
+                self.io_fds[fileobj.fileno ()] = fileobj
+            except :
+                pass                    # fd or no fileno
+            return
+        if events & POLL_READ :
+            self.io_read.append (fileobj)
+        if events & POLL_WRITE :
+            self.io_write.append (fileobj)
+
+    def unregister (self, fileobj) :
+        if fileobj not in self.io :
+            return
+        del self.io[fileobj]
+        if fileobj in self.ready :
+            del self.ready[fileobj]
+        if self.io_poll is not None :
+            self.io_poll.unregister (fileobj)
+            for fd in self.io_fds :
+                if self.io_fds[fd] is fileobj :
+                    del self.io_fds[fd]
+                    break
+            return
+        if fileobj in self.io_read :
+            self.io_read.remove (fileobj)
+        if fileobj in self.io_write :
+            self.io_write.remove (fileobj)
+
+    def wait_us (self, wait_us) :
+        if self.pipe_r is not None :
+            self.io_wait (wait_us)
+            return
+        while True :                    # sliced, the flag is set by an IRQ
+            slice_us = wait_us if wait_us < WAKE_SLICE_US else WAKE_SLICE_US
+            if self.io :
+                self.io_wait (slice_us)
+            elif slice_us > 0 :
+                time.sleep_us (slice_us)
+            wait_us -= slice_us
+            if wait_us <= 0 or self.flag :
+                return
+
+    def io_wait (self, wait_us) :
+        if self.io_poll is not None :
+            for item in self.io_poll.poll (wait_us // 1000) :
+                fileobj = item[0]       # python3: fd
+                self.ready[self.io_fds.get (fileobj, fileobj)] = item[1]
+        else :
+            read, write, error = select.select (self.io_read ,
+                                                self.io_write ,
+                                                [] ,
+                                                wait_us / 1000000)
+            for fileobj in read :
+                if fileobj is not self.pipe_r :
+                    self.ready[fileobj] = POLL_READ
+            for fileobj in write :
+                self.ready[fileobj] = self.ready.get (fileobj, 0) | POLL_WRITE
+        if self.ready :
+            self.flag = True            # I/O wakes the poll loop
+
+    def close (self) :
+        if self.pipe_r is not None :
+            os.close (self.pipe_r)
+            os.close (self.pipe_w)
+            self.io_read.remove (self.pipe_r)
+            self.pipe_r = None
+            self.pipe_w = None
+
+# end PollWaker
+
+#---------------------------------------------------------------------------
+# PollEntry - Poll loop bookkeeping for one plugin
+#   o every_cycle: poll_it called on every poll cycle
+#   o otherwise poll_it is only called when due_us is reached
+#     interval_us > 0: next due is due_us + interval_us (phase stable)
+#     interval_us <= 0: plugin sets its next due with poll_schedule
+#   o poll_add returns the PollEntry, the plugin's handle (poll_remove)
+#---------------------------------------------------------------------------
+class PollEntry :
+
+    def __init__ (self ,
+                  plugin ,
+                  order ,
+                  interval_us = 0 ,
+                  every_cycle = True ,
+                  is_async = False ,
+                  blocking = False ,
+                  priority = PRIORITY_NORMAL ,
+                  slices = 1 ,
+                  name = None ,
+                  tags = ()) :
+        self.plugin = plugin
+        self.order = order              # poll_add order, unique
+        self.slot = 0                   # plugin_array index, reused
+        self.name = name                # see poll_lookup
+        self.tags = tags                # see poll_tagged
+        self.removed = False            # see poll_remove
+        self.in_cycle = False           # in poll_cycle_entries
+        self.suspended = False          # backed off or disabled (faults)
+        self.disabled = False           # circuit breaker open
+        self.failures = 0               # poll_it exceptions
+        self.fail_streak = 0            # exceptions in a row
+        self.backoff_us = 0             # current backoff delay
+        self.last_error = None          # last poll_it exception
+        self.subscriptions = []         # message_subscribe mess_id's
+        self.io_objects = []            # io_register sockets/streams
+        self.interval_us = interval_us
+        self.every_cycle = every_cycle
+        self.is_async = is_async        # poll_it is "async def"
+        self.blocking = blocking        # poll_it run by PollThreadPool
+        self.priority = priority        # PRIORITY_CRITICAL .. PRIORITY_LOW
+        self.budget_mark = 0            # budget cycle of the last poll/defer
+        self.deferrals = 0              # deferred, cycle budget spent
+        self.task = None                # generator returned by poll_it
+        self.slices = slices            # task resumes per cycle
+        self.task_slices = 0            # task resumes
+        self.task_skips = 0             # polls while the task was running
+        self.in_flight = False          # blocking poll_it still running
+        self.offload_skips = 0          # due while still in flight
+        self.histogram = None           # PollHistogram, poll_it time
+        self.overruns = 0               # slowest plugin of overrun cycles
+        self.due_us = 0                 # Next due, poll_elapsed_us based
+        self.heap_seq = -1              # Queued heap item, -1: not queued
+        self.missed = 0                 # missed deadlines (scheduled)
+        self.missed_base = 0            # poll_missed_cycles at poll_add
+        self.late_last_us = 0           # poll time - due time
+        self.late_max_us = 0
+
+def poll_entry_order (entry) :
+    return entry.order
+
+# end PollEntry
+
+#---------------------------------------------------------------------------
+# PollHistogram - Fixed size log2 histogram of microsecond times
+#   o bucket 0: 0us, bucket n: 2**(n-1) .. 2**n - 1 us
+#   o add doesn't allocate memory
+#---------------------------------------------------------------------------
+HISTOGRAM_BUCKETS = 26              # last bucket: >= 16.7 seconds
+
+class PollHistogram :
+
+    def __init__ (self, buckets = HISTOGRAM_BUCKETS) :
+        self.buckets = array ('L', [0] * buckets)
+        self.reset ()
+
+    def reset (self) :
+        for bucket in range (len (self.buckets)) :
+            self.buckets[bucket] = 0
+        self.count = 0
+        self.total_us = 0
+        self.min_us = -1
+        self.max_us = 0
+        self.last_us = 0
+
+    def add (self, time_us) :
+        if time_us < 0 :
+            time_us = 0
+        bucket = 0
+        value = time_us
+        while value > 0 :
+            value >>= 1
+            bucket += 1
+        if bucket >= len (self.buckets) :
+            bucket = len (self.buckets) - 1
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total_us += time_us
+        self.last_us = time_us
+        if time_us > self.max_us :
+            self.max_us = time_us
+        if self.min_us < 0 or time_us < self.min_us :
+            self.min_us = time_us
+
+    def percentile_us (self, percent) :
+        #---- Upper bound of the bucket holding the percentile
+        if self.count <= 0 :
+            return 0
+        limit = self.count * percent / 100
+        count = 0
+        for bucket in range (len (self.buckets)) :
+            count += self.buckets[bucket]
+            if count >= limit :
+                return min ((1 << bucket) - 1, self.max_us)
+        return self.max_us
+
+    def summary (self) :
+        return {"count" : self.count ,
+                "min_us" : max (self.min_us, 0) ,
+                "mean_us" : self.total_us // self.count if self.count else 0 ,
+                "p50_us" : self.percentile_us (50) ,
+                "p99_us" : self.percentile_us (99) ,
+                "max_us" : self.max_us ,
+                "last_us" : self.last_us ,
+                "buckets" : list (self.buckets)}
+
+# end PollHistogram
+
+#---------------------------------------------------------------------------
+# PollHistory - Fixed size ring of (tick_ms, value) of one message entry
+#   o Preallocated, add doesn't allocate memory (typecode: array values)
+#   o Queries walk back from the newest value, only the window is read
+#   o tick_ms: poll time ms (get_current_time_ms), wrap safe
+#---------------------------------------------------------------------------
+class PollHistory :
+
+    def __init__ (self, capacity = 64, typecode = None) :
+        self.capacity = capacity
+        self.typecode = typecode        # None: any value, else numbers only
+        self.ticks = [0] * capacity
+        if typecode is None :
+            self.values = [None] * capacity
+        else :
+            self.values = array (typecode, [0] * capacity)
+        self.head = 0                   # next write index
+        self.count = 0                  # values in the ring
+        self.total = 0                  # values added, doesn't wrap
+
+    def add (self, tick_ms, value) :
+        if self.typecode is not None \
+                and not isinstance (value, (int, float)) :
+            return                      # not a number, not kept
+        head = self.head
+        try :
+            self.values[head] = value
+        except TypeError :              # float, integer typecode
+            try :
+                self.values[head] = int (value)
+            except (OverflowError, ValueError) :
+                return                  # inf, nan: not kept
+        except OverflowError :
+            return                      # out of the typecode range
+        self.ticks[head] = tick_ms
+        head += 1
+        if head >= self.capacity :
+            head = 0
+        self.head = head
+        if self.count < self.capacity :
+            self.count += 1
+        self.total += 1
+
+    def index (self, age) :
+        #---- Ring index, age 0: newest value
+        return (self.head - 1 - age) % self.capacity
+
+    def newest (self) :
+        #---- (tick_ms, value), None if empty
+        if self.count == 0 :
+            return None
+        index = self.index (0)
+        return (self.ticks[index], self.values[index])
+
+    def count_since (self, since_ms) :
+        #---- Number of values with tick_ms >= since_ms
+        count = 0
+        while count < self.count \
+                and time.ticks_diff (self.ticks[self.index (count)] ,
+                                     since_ms) >= 0 :
+            count += 1
+        return count
+
+    def window (self, count = None, since_ms = None) :
+        #---- Number of newest values: last count and/or since since_ms
+        if count is None or count > self.count :
+            count = self.count
+        if since_ms is not None :
+            since_count = self.count_since (since_ms)
+            if since_count < count :
+                count = since_count
+        return count
+
+    def last (self, count = None, since_ms = None) :
+        #---- [(tick_ms, value), ...] oldest first
+        count = self.window (count, since_ms)
+        ticks = self.ticks
+        values = self.values
+        entries = []
+        for age in range (count - 1, -1, -1) :
+            index = self.index (age)
+            entries.append ((ticks[index], values[index]))
+        return entries
+
+    def since (self, since_ms) :
+        return self.last (None, since_ms)
+
+    def stats (self, count = None, since_ms = None) :
+        #---- (min, max, mean) of the numbers in the window, None if none
+        count = self.window (count, since_ms)
+        values = self.values
+        minimum = None
+        maximum = None
+        total = 0
+        numbers = 0
+        for age in range (count) :
+            value = values[self.index (age)]
+            if not isinstance (value, (int, float)) or value is True \
+                    or value is False :
+                continue
+            if numbers == 0 or value < minimum :
+                minimum = value
+            if numbers == 0 or value > maximum :
+                maximum = value
+            total += value
+            numbers += 1
+        if numbers == 0 :
+            return None
+        return (minimum, maximum, total / numbers)
+
+    def age_ms (self, now_ms) :
+        #---- ms since the newest value, None if empty
+        if self.count == 0 :
+            return None
+        return time.ticks_diff (now_ms, self.ticks[self.index (0)])
+
+    def stale (self, now_ms, max_age_ms) :
+        #---- True if empty or the newest value is older than max_age_ms
+        age_ms = self.age_ms (now_ms)
+        return age_ms is None or age_ms > max_age_ms
+
+# end PollHistory
+
+#---------------------------------------------------------------------------
+# PollTiming - Cycle timing
+#   o busy: poll_plugins start to poll_wait
+#   o slack: poll_wait sleep time
+#   o jitter: actual wake up time - planned wake up time
+#   o overruns: cycles exceeding the poll interval, the slowest plugin of
+#     the cycle gets the PollEntry overruns count
+#---------------------------------------------------------------------------
+class PollTiming :
+
+    def __init__ (self, clock) :
+        self.clock = clock
+        self.busy = PollHistogram ()
+        self.slack = PollHistogram ()
+        self.jitter = PollHistogram ()
+        self.reset ()
+
+    def reset (self) :
+        self.busy.reset ()
+        self.slack.reset ()
+        self.jitter.reset ()
+        self.cycles = 0
+        self.overruns = 0
+        self.cycle_start_us = self.clock.ticks_us ()
+        self.wake_us = None             # Planned wake up time
+        self.cycle_max_us = -1
+        self.cycle_max_entry = None     # Slowest plugin of the cycle
+
+    def cycle_start (self) :
+        now_us = self.clock.ticks_us ()
+        if self.wake_us is not None :
+            self.jitter.add (self.clock.ticks_diff (now_us, self.wake_us))
+            self.wake_us = None
+        self.cycle_start_us = now_us
+        self.cycle_max_us = -1
+        self.cycle_max_entry = None
+
+    def entry_time (self, entry, time_us) :
+        if entry.histogram is None :
+            entry.histogram = PollHistogram ()
+        entry.histogram.add (time_us)
+        if time_us > self.cycle_max_us :
+            self.cycle_max_us = time_us
+            self.cycle_max_entry = entry
+
+    def cycle_end (self, sleep_us, overrun) :
+        now_us = self.clock.ticks_us ()
+        self.cycles += 1
+        self.busy.add (self.clock.ticks_diff (now_us, self.cycle_start_us))
+        if overrun :
+            self.overruns += 1
+            if self.cycle_max_entry is not None :
+                self.cycle_max_entry.overruns += 1
+        else :
+            self.slack.add (sleep_us)
+            self.wake_us = self.clock.ticks_add (now_us, sleep_us)
+
+# end PollTiming
+
+#---------------------------------------------------------------------------
+# PollTracer - Binary trace of poll cycle and plugin events
+#   o Preallocated ring buffer of fixed size records, recording doesn't
+#     allocate memory. The oldest records are overwritten.
+#   o python3 with path: the buffer is a memory mapped file, the trace
+#     survives a crash. Otherwise save writes the buffer to a file.
+#   o File: header, records, plugin names (one per line, written by save)
+#   o Record: time (us since the previous record), event, plugin order,
+#     value. Convert with poll_trace.py (timeline or Chrome trace JSON).
+#---------------------------------------------------------------------------
+TRACE_MAGIC = b"PLTR"
+TRACE_HEADER = "<4sHHII"            # magic, version, record size, records,
+TRACE_HEADER_SIZE = 16              # records written
+TRACE_RECORD = "<IBxHi"             # delta us, event, plugin order, value
+TRACE_RECORD_SIZE = 12
+TRACE_NO_PLUGIN = 0xFFFF
+TRACE_DELTA_MAX = 0xFFFFFFFF        # record field ranges, clamped
+TRACE_VALUE_MAX = 0x7FFFFFFF
+
+TRACE_CYCLE_START = 1
+TRACE_CYCLE_END = 2                 # value: busy us
+TRACE_ENTER = 3                     # plugin poll_it (or task slice) start
+TRACE_EXIT = 4                      # value: poll_it us
+TRACE_SLEEP = 5                     # value: planned sleep us
+TRACE_WAKE = 6                      # value: 1 woken by wake/I/O, 0 timer
+TRACE_OVERRUN = 7                   # value: us late
+
+class PollTracer :
+
+    def __init__ (self, clock, records = 4096, path = None) :
+        self.clock = clock
+        self.records = records
+        self.count = 0                  # records written, doesn't wrap
+        self.path = path
+        self.file = None
+        size = TRACE_HEADER_SIZE + records * TRACE_RECORD_SIZE
+        if path is not None and mmap is not None :
+            self.file = open (path, "w+b")
+            self.file.truncate (size)
+            self.buffer = mmap.mmap (self.file.fileno (), size)
+        else :
+            self.buffer = bytearray (size)
+        self.last_us = clock.ticks_us ()
+        self.cycle_start_us = self.last_us
+        self.header ()
+
+    def header (self) :
+        struct.pack_into (TRACE_HEADER, self.buffer, 0 ,
+                          TRACE_MAGIC, 1, TRACE_RECORD_SIZE ,
+                          self.records, self.count & 0xFFFFFFFF)
+
+    def record (self, event, order = TRACE_NO_PLUGIN, value = 0, now_us = None) :
+        clock = self.clock
+        if now_us is None :
+            now_us = clock.ticks_us ()
+        delta_us = clock.ticks_diff (now_us, self.last_us)
+        self.last_us = now_us
+        if delta_us < 0 :
+            delta_us = 0
+        elif delta_us > TRACE_DELTA_MAX :
+            delta_us = TRACE_DELTA_MAX
+        if value > TRACE_VALUE_MAX :    # e.g. long tickless sleep
+            value = TRACE_VALUE_MAX
+        elif value < -TRACE_VALUE_MAX :
+            value = -TRACE_VALUE_MAX
+        if order > TRACE_NO_PLUGIN :
+            order = TRACE_NO_PLUGIN
+        struct.pack_into (TRACE_RECORD, self.buffer ,
+                          TRACE_HEADER_SIZE
+                            + (self.count % self.records) * TRACE_RECORD_SIZE ,
+                          delta_us, event, order, value)
+        self.count += 1
+        self.header ()
+
+    def cycle_start (self) :
+        now_us = self.clock.ticks_us ()
+        self.cycle_start_us = now_us
+        self.record (TRACE_CYCLE_START, now_us = now_us)
+
+    def cycle_end (self, now_us) :
+        self.record (TRACE_CYCLE_END ,
+                     value = self.clock.ticks_diff (now_us, self.cycle_start_us) ,
+                     now_us = now_us)
+
+    def save (self, path = None, names = None) :
+        #---- Write the trace (memory mapped: flush) and the plugin names
+        if path is None :
+            path = self.path
+        if self.file is not None and path == self.path :
+            self.buffer.flush ()
+            trace_file = self.file
+            trace_file.seek (len (self.buffer))
+        else :
+            trace_file = open (path, "wb")
+            trace_file.write (self.buffer)
+        if names :
+            trace_file.write (("\n".join (names) + "\n").encode ())
+        if trace_file is self.file :
+            trace_file.truncate ()      # names of an earlier save
+            trace_file.flush ()
+        else :
+            trace_file.close ()
+
+    def close (self, names = None) :
+        if self.path is not None :
+            self.save (self.path, names)
+        if self.file is not None :
+            self.buffer.close ()
+            self.file.close ()
+            self.file = None
+
+# end PollTracer
+
+#---------------------------------------------------------------------------
+# PollGC - Garbage collection in the poll_wait slack time
+#   o Full collection every interval_us, only if the slack (sleep time)
+#     is longer than the estimated pause + GC_MARGIN_US, else deferred
+#   o python3: while a full collection doesn't fit, the young generation
+#     is collected (gc.collect (0)) if its threshold is reached
+#   o Pause estimates follow the slowest pause and decay slowly
+#   o auto = False disables the automatic gc, use with care on
+#     micropython: allocations fail instead of collecting
+#---------------------------------------------------------------------------
+GC_MARGIN_US = 200
+
+class PollGC :
+
+    def __init__ (self ,
+                  clock ,
+                  interval_us ,
+                  auto = True) :
+        self.clock = clock
+        self.interval_us = interval_us
+        self.auto = auto
+        if auto :
+            gc.enable ()
+        else :
+            gc.disable ()
+        self.pauses = PollHistogram ()
+        self.full_est_us = 0            # estimated full collection pause
+        self.young_est_us = 0           # estimated young collection pause
+        self.full_count = 0
+        self.young_count = 0
+        self.deferred = 0               # full collection didn't fit
+        self.since_full_us = 0
+        self.check_us = clock.ticks_us ()
+
+    def collect (self, generation = None) :
+        clock = self.clock
+        start_us = clock.ticks_us ()
+        if generation is None :
+            gc.collect ()
+        else :
+            gc.collect (generation)
+        pause_us = clock.ticks_diff (clock.ticks_us (), start_us)
+        self.pauses.add (pause_us)
+        return pause_us
+
+    def full (self) :
+        pause_us = self.collect ()
+        self.full_count += 1
+        self.full_est_us = max (pause_us ,
+                                self.full_est_us - self.full_est_us // 8)
+        self.since_full_us = 0
+        self.check_us = self.clock.ticks_us ()
+
+    def slack (self, slack_us) :
+        now_us = self.clock.ticks_us ()
+        self.since_full_us += self.clock.ticks_diff (now_us, self.check_us)
+        self.check_us = now_us
+        if self.since_full_us >= self.interval_us :
+            if slack_us >= self.full_est_us + GC_MARGIN_US :
+                self.full ()
+                return
+            self.deferred += 1
+        if GC_GENERATIONS \
+                and gc.get_count ()[0] >= gc.get_threshold ()[0] \
+                and slack_us >= self.young_est_us + GC_MARGIN_US :
+            pause_us = self.collect (0)
+            self.young_count += 1
+            self.young_est_us = max (pause_us ,
+                                     self.young_est_us - self.young_est_us // 8)
+
+    def stats (self) :
+        return {"full" : self.full_count ,
+                "young" : self.young_count ,
+                "deferred" : self.deferred ,
+                "full_est_us" : self.full_est_us ,
+                "young_est_us" : self.young_est_us ,
+                "pause" : self.pauses.summary ()}
+
+# end PollGC
+
+#---------------------------------------------------------------------------
+# PollAdaptive - Adaptive poll interval
+#   o Activity (PollLooper activity, message changes, wake, I/O) sets the
+#     interval to min_us: "active"
+#   o Every idle_cycles cycles without activity the interval is doubled
+#     up to max_us: "slowing", at max_us: "idle"
+#   o State changes are logged: (poll_time_ms, from, to, interval_us),
+#     the last log_size are kept
+#---------------------------------------------------------------------------
+class PollAdaptive :
+
+    def __init__ (self ,
+                  min_us ,
+                  max_us ,
+                  idle_cycles = 10 ,
+                  log_size = 16) :
+        self.min_us = min_us
+        self.max_us = max_us
+        self.idle_cycles = idle_cycles
+        self.log_size = log_size
+        self.interval_us = min_us
+        self.state = "active"
+        self.active = False             # activity this cycle
+        self.idle_count = 0
+        self.transitions = 0
+        self.state_cycles = {"active" : 0, "slowing" : 0, "idle" : 0}
+        self.log = []
+
+    def cycle (self, poll_ms) :
+        #---- Returns the next poll interval
+        interval_us = self.interval_us
+        if self.active :
+            self.active = False
+            self.idle_count = 0
+            interval_us = self.min_us
+        else :
+            self.idle_count += 1
+            if self.idle_count >= self.idle_cycles :
+                self.idle_count = 0
+                interval_us = min (interval_us * 2, self.max_us)
+        if interval_us <= self.min_us :
+            state = "active"
+        elif interval_us >= self.max_us :
+            state = "idle"
+        else :
+            state = "slowing"
+        if state != self.state :
+            self.transitions += 1
+            if len (self.log) >= self.log_size :
+                self.log.pop (0)
+            self.log.append ((poll_ms, self.state, state, interval_us))
+            self.state = state
+        self.state_cycles[state] += 1
+        self.interval_us = interval_us
+        return interval_us
+
+    def stats (self) :
+        return {"state" : self.state ,
+                "interval_us" : self.interval_us ,
+                "transitions" : self.transitions ,
+                "state_cycles" : dict (self.state_cycles) ,
+                "log" : list (self.log)}
+
+# end PollAdaptive
+
+#---------------------------------------------------------------------------
+# PollThreadPool - Runs blocking plugin poll_it's on up to max_threads
+#   o Only the poll loop calls submit and start_jobs
+#   o Finished jobs are saved in done as (PollEntry, result, exception)
+#     and applied by the poll loop at the next cycle boundary
+#---------------------------------------------------------------------------
+class PollWorker :
+
+    def __init__ (self, pool) :
+        self.pool = pool
+        self.entry = None               # Job, None: exit
+        self.wake = _thread.allocate_lock ()
+        self.wake.acquire ()            # Released when there is a job
+
+    def run (self) :
+        pool = self.pool
+        while True :
+            self.wake.acquire ()
+            entry = self.entry
+            if entry is None :
+                break
+            result = None
+            error = None
+            try :
+                result = entry.plugin.poll_it ()
+            except Exception as e :
+                error = e
+            pool.lock.acquire ()
+            pool.done.append ((entry, result, error))
+            pool.busy -= 1
+            self.entry = None
+            running = pool.running
+            if running :
+                pool.idle.append (self)
+            pool.lock.release ()
+            if not running :
+                break
+
+# end PollWorker
+
+class PollThreadPool :
+
+    def __init__ (self, max_threads = 2) :
+        self.max_threads = max_threads
+        self.lock = _thread.allocate_lock ()
+        self.thread_count = 0
+        self.idle = []                  # PollWorker's waiting for a job
+        self.queue = []                 # PollEntry's waiting for a thread
+        self.done = []
+        self.busy = 0                   # jobs running
+        self.running = True
+
+    def submit (self, entry) :
+        if entry.in_flight :            # never run twice at the same time
+            entry.offload_skips += 1
+            return False
+        entry.in_flight = True
+        self.queue.append (entry)
+        self.start_jobs ()
+        return True
+
+    def start_jobs (self) :
+        while self.queue :
+            self.lock.acquire ()
+            worker = self.idle.pop () if self.idle else None
+            self.lock.release ()
+            if worker is None :
+                if self.thread_count >= self.max_threads :
+                    return              # wait for a free thread
+                worker = PollWorker (self)
+                self.thread_count += 1
+                _thread.start_new_thread (worker.run, ())
+            worker.entry = self.queue.pop (0)
+            self.lock.acquire ()
+            self.busy += 1
+            self.lock.release ()
+            worker.wake.release ()
+
+    def collect (self) :
+        self.lock.acquire ()
+        done = self.done
+        self.done = []
+        self.lock.release ()
+        return done
+
+    def in_flight (self) :
+        return self.thread_count - len (self.idle)
+
+    def stop (self, wait_ms = 0) :
+        #---- Waits up to wait_ms for the running jobs, queued jobs are
+        #---- dropped. Returns False if jobs are still running.
+        self.lock.acquire ()
+        self.running = False
+        idle = self.idle
+        self.idle = []
+        self.lock.release ()
+        for worker in idle :
+            worker.entry = None
+            worker.wake.release ()
+        for entry in self.queue :
+            entry.in_flight = False     # never started
+        self.queue = []
+        start_ms = time.ticks_ms ()
+        while self.busy > 0 \
+                and time.ticks_diff (time.ticks_ms (), start_ms) < wait_ms :
+            time.sleep_ms (1)
+        return self.busy <= 0
+
+# end PollThreadPool
+
+#---------------------------------------------------------------------------
+# PollGroupRunner - Polls a rate group inside the parent poll loop
+#   o Used by PollLooper group_add when threads are not available
+#   o Added to the parent as a scheduled plugin, interval: group interval
+#---------------------------------------------------------------------------
+class PollGroupRunner :
+
+    def __init__ (self, group) :
+        self.group = group
+
+    def poll_it (self) :
+        group = self.group
+        group.poll_time_set (group.group_parent.poll_time_us)
+        group.current_time_ms = group.poll_time_ms
+        group.poll_plugins ()
+
+    def shutdown (self) :
+        self.group.poll_shutdown_plugins ()
+
+# end PollGroupRunner
+
+#---------------------------------------------------------------------------
+# PollCheckpoint - Periodic message_data snapshot for a warm restart
+#   o Added by PollLooper checkpoint_enable as a low priority scheduled
+#     plugin, only writes when message_data changed (message_version)
+#   o poll_it returns a generator (see poll_tasks_run): one DictID or
+#     chunk bytes are written per poll cycle
+#   o Written to path.tmp, renamed to path when complete (atomic on
+#     python3 and littlefs; FAT: the old file is removed first)
+#   o Each DictID is consistent, the snapshot as a whole may mix poll
+#     cycles. Values: None, bool, int (64 bits), float, str, bytes, list,
+#     tuple (restored as list) and dict. DictIDs with other values or with
+#     tuple keys are skipped.
+#   o File: magic, records (DictID: "R", size, DictID, dict), "E". A
+#     record that can't be decoded is skipped on restore.
+#---------------------------------------------------------------------------
+CHECKPOINT_MAGIC = b"PLCK2"
+CHECKPOINT_RECORD = b"R"
+CHECKPOINT_END = b"E"
+
+def checkpoint_encode (data, value) :
+    #---- Appends value to bytearray data
+    if value is None :
+        data.extend (b"N")
+    elif value is True :
+        data.extend (b"T")
+    elif value is False :
+        data.extend (b"F")
+    elif isinstance (value, int) :
+        if -0x80000000 <= value <= 0x7FFFFFFF :
+            data.extend (b"i")
+            data.extend (struct.pack ("<i", value))
+        elif -0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF :
+            data.extend (b"q")
+            data.extend (struct.pack ("<q", value))
+        else :
+            raise TypeError ("checkpoint: int over 64 bits")
+    elif isinstance (value, float) :
+        data.extend (b"f")
+        data.extend (struct.pack ("<d", value))
+    elif isinstance (value, str) :
+        value = value.encode ()
+        data.extend (b"s")
+        data.extend (struct.pack ("<I", len (value)))
+        data.extend (value)
+    elif isinstance (value, (bytes, bytearray)) :
+        data.extend (b"b")
+        data.extend (struct.pack ("<I", len (value)))
+        data.extend (value)
+    elif isinstance (value, (list, tuple)) :
+        data.extend (b"l")
+        data.extend (struct.pack ("<I", len (value)))
+        for item in value :
+            checkpoint_encode (data, item)
+    elif isinstance (value, dict) :
+        data.extend (b"d")
+        data.extend (struct.pack ("<I", len (value)))
+        for key in value :
+            checkpoint_encode_key (data, key)
+            checkpoint_encode (data, value[key])
+    else :
+        raise TypeError ("checkpoint: " + str (type (value)))
+
+def checkpoint_encode_key (data, key) :
+    #---- Dictionary key: a tuple is decoded as list, not hashable
+    if isinstance (key, tuple) :
+        raise TypeError ("checkpoint: tuple key")
+    checkpoint_encode (data, key)
+
+def checkpoint_decode (data, pos) :
+    #---- Returns (value, next pos)
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b"N" :
+        return (None, pos)
+    if tag == b"T" :
+        return (True, pos)
+    if tag == b"F" :
+        return (False, pos)
+    if tag == b"i" :
+        return (struct.unpack_from ("<i", data, pos)[0], pos + 4)
+    if tag == b"q" :
+        return (struct.unpack_from ("<q", data, pos)[0], pos + 8)
+    if tag == b"f" :
+        return (struct.unpack_from ("<d", data, pos)[0], pos + 8)
+    length = struct.unpack_from ("<I", data, pos)[0]
+    pos += 4
+    if tag == b"s" :
+        return (str (data[pos:pos + length], "utf-8"), pos + length)
+    if tag == b"b" :
+        return (bytes (data[pos:pos + length]), pos + length)
+    if tag == b"l" :
+        value = []
+        for _ in range (length) :
+            item, pos = checkpoint_decode (data, pos)
+            value.append (item)
+        return (value, pos)
+    if tag == b"d" :
+        value = {}
+        for _ in range (length) :
+            key, pos = checkpoint_decode (data, pos)
+            value[key], pos = checkpoint_decode (data, pos)
+        return (value, pos)
+    raise ValueError ("checkpoint: tag " + str (tag))
+
+class PollCheckpoint :
+
+    def __init__ (self, poller, path, chunk = 512) :
+        self.poller = poller
+        self.path = path
+        self.chunk = chunk
+        self.saved = {}                 # message_versions of the last write
+        self.writes = 0
+        self.skipped = 0                # DictIDs not encodable
+        self.bad = 0                    # DictIDs not restored, damaged
+        self.bytes = 0                  # size of the last checkpoint
+
+    def poll_it (self) :
+        if self.poller.message_versions == self.saved :
+            return None                 # unchanged
+        return self.write ()
+
+    def write (self) :
+        #---- Generator, yields after each DictID/chunk
+        poller = self.poller
+        versions = dict (poller.message_versions)
+        tmp_path = self.path + ".tmp"
+        ckpt_file = open (tmp_path, "wb")
+        try :
+            ckpt_file.write (CHECKPOINT_MAGIC)
+            size = len (CHECKPOINT_MAGIC)
+            for mess_id in list (poller.message_data) :
+                mess_dict = poller.message_snapshot (mess_id)
+                if mess_dict is None :
+                    continue
+                data = bytearray (CHECKPOINT_RECORD)
+                data.extend (bytes (4))         # record size
+                try :
+                    checkpoint_encode_key (data, mess_id)
+                    checkpoint_encode (data, mess_dict)
+                except (TypeError, OverflowError, ValueError, STRUCT_ERROR) :
+                    self.skipped += 1
+                    continue
+                struct.pack_into ("<I", data, 1, len (data) - 5)
+                view = memoryview (data)
+                for start in range (0, len (data), self.chunk) :
+                    ckpt_file.write (view[start:start + self.chunk])
+                    yield
+                size += len (data)
+            ckpt_file.write (CHECKPOINT_END)
+            ckpt_file.flush ()
+            if hasattr (os, "fsync") :
+                os.fsync (ckpt_file.fileno ())
+            ckpt_file.close ()
+            ckpt_file = None
+            if hasattr (os, "replace") :
+                os.replace (tmp_path, self.path)
+            else :
+                try :
+                    os.rename (tmp_path, self.path)
+                except OSError :        # FAT: no rename over a file
+                    os.remove (self.path)
+                    os.rename (tmp_path, self.path)
+            self.saved = versions
+            self.writes += 1
+            self.bytes = size + len (CHECKPOINT_END)
+        finally :
+            if ckpt_file is not None :  # not completed
+                ckpt_file.close ()
+                os.remove (tmp_path)
+
+    def save (self) :
+        #---- Complete checkpoint now
+        for _ in self.write () :
+            pass
+
+    def restore (self) :
+        #---- Returns {mess_id : mess_dict}, None: no valid checkpoint
+        try :
+            ckpt_file = open (self.path, "rb")
+            data = ckpt_file.read ()
+            ckpt_file.close ()
+        except OSError :
+            return None
+        if data[:len (CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC :
+            return None
+        messages = {}
+        pos = len (CHECKPOINT_MAGIC)
+        while data[pos:pos + 1] != CHECKPOINT_END :
+            if data[pos:pos + 1] != CHECKPOINT_RECORD \
+                    or pos + 5 > len (data) :
+                return None             # incomplete or damaged
+            end = pos + 5 + struct.unpack_from ("<I", data, pos + 1)[0]
+            if end > len (data) :
+                return None
+            try :
+                mess_id, pos = checkpoint_decode (data, pos + 5)
+                mess_dict, pos = checkpoint_decode (data, pos)
+                if pos != end or not isinstance (mess_dict, dict) :
+                    raise ValueError ("checkpoint: record size")
+                messages[mess_id] = mess_dict
+            except Exception :
+                self.bad += 1           # skip the DictID
+            pos = end
+        return messages
+
+    def stats (self) :
+        return {"writes" : self.writes ,
+                "skipped" : self.skipped ,
+                "bad" : self.bad ,
+                "bytes" : self.bytes}
+
+    def shutdown (self) :
+        if self.poller.message_versions != self.saved :
+            self.save ()                # before the other plugins shut down
+
+# end PollCheckpoint
 
 #---------------------------------------------------------------------------
 # PollLooper
@@ -79,32 +1361,381 @@ class PollLooper :
     
     def __init__(self,
                  poll_ms = 100 ,         # default poll interval: 0.1 sec
-                 use_asyncio = False) :
+                 use_asyncio = False ,
+                 offload_threads = 2 ,   # threads for blocking plugins
+                 timing = False ,        # collect poll_stats timing
+                 poll_us = None ,        # poll interval in microseconds
+                 clock = None) :         # PollClock compatible clock
         #print ("Globals: init")
-        self.current_time_ms = time.ticks_ms ()
+        if clock is None :
+            clock = PollClock ()
+        self.clock = clock
+        self.current_time_ms = clock.ticks_ms ()
         self.use_asyncio = use_asyncio
+        if poll_us is None :
+            poll_us = ms_to_us (poll_ms)
+        else :
+            poll_ms = poll_us / 1000
+        self.poll_interval_us = poll_us
         self.poll_interval_ms = poll_ms
-        self.poll_time_ms = 0
-        self.poll_time_next_ms = 0      # Next poll time
+        self.poll_time_ms = self.current_time_ms
+        self.poll_time_us = clock.ticks_us ()
+        self.poll_time_frac_us = 0      # poll_time_ms remainder
+        self.poll_time_next_us = 0      # Next poll time
+        self.poll_elapsed_us = 0        # Non wrapping poll_time_us
+        self.poll_sleep_us = 0          # Last poll_wait sleep time
+        self.poll_heap = []             # Scheduled: (due_us, seq, PollEntry)
         self.poll_init ()
-        self.plugin_array = []          # PlugIn's to be polled
+        self.plugin_array = []          # PlugIn's by slot, None: free
+        self.poll_entries = {}          # id (plugin) : PollEntry
+        self.poll_cycle_entries = []    # Polled every cycle
+        self.poll_order_next = 0        # next poll_add order
+        self.poll_free_slots = []       # free plugin_array slots
+        self.poll_names = {}            # name : PollEntry
+        self.poll_tags = {}             # tag : {order : PollEntry}
+        self.poll_added = []            # every cycle, next cycle start
+        self.poll_removed = []          # poll_remove, next cycle start
+        self.poll_retiring = []         # removed, shutdown pending
+        self.poll_faulted = False       # every cycle plugin suspended
+        self.fault_isolate = True       # see fault_policy
+        self.fault_backoff_us = 100000
+        self.fault_backoff_max_us = 60000000
+        self.fault_breaker = 10
+        self.poll_heap_seq = 0
+        self.poll_async_count = 0       # async plugins added
+        self.poll_awaits = []           # async poll_it's of this cycle
+        self.offload_threads = offload_threads
+        self.poll_pool = None           # PollThreadPool, blocking plugins
+        self.poll_timing = None         # PollTiming, see timing_enable
+        self.poll_trace = None          # PollTracer, see trace_enable
+        self.poll_checkpoint = None     # PollCheckpoint, see checkpoint_enable
+        self.poll_gc = None             # PollGC, see gc_enable
+        self.poll_adaptive = None       # PollAdaptive, see adaptive_enable
+        self.poll_fixed_us = poll_us    # poll interval without adaptive
+        self.overrun = OVERRUN_REANCHOR # see overrun_policy
+        self.catchup_max = 10
+        self.catchup_count = 0          # catch up polls in a row
+        self.poll_missed_cycles = 0     # poll cycles skipped by overruns
+        self.poll_budget_us = 0         # see budget_set, 0: no budget
+        self.poll_budget_cycles = 0     # budget cycle counter
+        self.poll_deferred = []         # deferred PollEntry's, oldest first
+        self.poll_budget_start_us = 0   # plugin polling start, budget_set
+        self.poll_tasks = []            # PollEntry's with a running task
+        self.poll_task_next = 0         # first task resumed, round robin
+        self.slice_max = 0              # see slice_limit, 0: no limit
+        self.poll_waker = PollWaker ()  # see wake
+        self.poll_wakeups = 0           # sleeps ended by wake or I/O
+        self.io_entries = {}            # registered I/O : [PollEntry, ...]
+        self.timing_enable (timing)
         self.message_data = {}
+        self.message_versions = {}      # mess_id : change counter
+        self.message_subscribers = {}   # mess_id : [PollEntry, ...]
+        self.message_histories = {}     # mess_id : {entry_id : PollHistory}
+        self.message_history_all = {}   # mess_id : (capacity, typecode)
+        self.message_lock = None        # shared by rate groups
+        self.message_loopers = [self]   # loopers sharing message_data
+        self.message_pending = []       # changes from other rate groups
+        self.poll_groups = []           # rate groups, see group_add
+        self.group_parent = None
+        self.group_thread = False       # group runs on its own thread
+        self.group_done = None          # released when the thread ends
         self.states = {
             'running' : True
             }
         self.show_timeout = True
 
     def poll_init (self) :
-        self.poll_time_ms = time.ticks_ms () # Current poll time
-        if self.poll_interval_ms > 0 :
-            self.poll_time_next_ms = time.ticks_add (self.poll_time_ms,
-                                                    self.poll_interval_ms)
+        self.poll_time_set (self.clock.ticks_us ()) # Current poll time
+        self.current_time_ms = self.poll_time_ms
+        if self.poll_interval_us > 0 :
+            self.poll_time_next_us = self.clock.ticks_add (self.poll_time_us,
+                                                        self.poll_interval_us)
+    def poll_time_set (self, poll_us) :
+        #---- poll_time_ms follows poll_time_us without drift
+        delta_us = self.clock.ticks_diff (poll_us, self.poll_time_us)
+        self.poll_time_us = poll_us
+        self.poll_time_frac_us += delta_us
+        if self.poll_time_frac_us >= 1000 :
+            delta_ms = self.poll_time_frac_us // 1000
+            self.poll_time_frac_us -= delta_ms * 1000
+            self.poll_time_ms = time.ticks_add (self.poll_time_ms, delta_ms)
+        #---- poll_elapsed_us doesn't wrap, used for the scheduler heap
+        self.poll_elapsed_us += delta_us
+        if self.poll_elapsed_us >= POLL_REBASE_US :
+            self.poll_rebase ()
+    def poll_rebase (self) :
+        #---- Shift the scheduler time base back to zero, order is unchanged
+        shift_us = self.poll_elapsed_us
+        heap = self.poll_heap
+        for index in range (len (heap)) :
+            item = heap[index]
+            heap[index] = (item[0] - shift_us, item[1], item[2])
+        for entry in self.poll_entries.values () :
+            entry.due_us -= shift_us
+        self.poll_elapsed_us = 0
+    def poll_time_ms_at (self, ticks_us) :
+        #---- ms counter for a clock.ticks_us () time after poll_time_us
+        return time.ticks_add (self.poll_time_ms ,
+                               (self.poll_time_frac_us
+                                + self.clock.ticks_diff (ticks_us,
+                                                        self.poll_time_us))
+                                    // 1000)
 
-    def poll_add (self, plugin) :
-        self.plugin_array.append (plugin)
+    def poll_add (self ,
+                  plugin ,
+                  interval_ms = 0 ,
+                  delay_ms = None ,
+                  is_async = None ,
+                  blocking = False ,
+                  subscribe = None ,
+                  io = None ,
+                  priority = PRIORITY_NORMAL ,
+                  slices = 1 ,
+                  name = None ,
+                  tags = None) :
+        #---- interval_ms and/or delay_ms: plugin is polled only when due
+        #---- decimal ms allowed, e.g. interval_ms = 0.25 is 250 us
+        #---- subscribe: mess_id list, plugin is polled when one changes
+        #---- io: socket/stream list, plugin is polled when one is readable
+        #---- priority: PRIORITY_CRITICAL, _NORMAL or _LOW, see budget_set
+        #---- slices: generator poll_it resumes per cycle, see poll_tasks_run
+        #---- name, tags: see poll_lookup, poll_tagged
+        #---- Can be called while polling, every cycle plugins are polled
+        #---- from the next poll cycle on
+        if name is not None and name in self.poll_names :
+            raise ValueError ("poll_add: duplicate name " + name)
+        every_cycle = interval_ms <= 0 and delay_ms is None \
+                        and not subscribe and not io
+        if is_async is None :           # detect "async def poll_it"
+            is_async = iscoroutinefunction (plugin.poll_it)
+        entry = PollEntry (plugin ,
+                           self.poll_order_next ,
+                           ms_to_us (interval_ms) ,
+                           every_cycle ,
+                           is_async ,
+                           blocking ,
+                           priority ,
+                           slices ,
+                           name ,
+                           tuple (tags) if tags else ())
+        self.poll_order_next += 1
+        if self.poll_free_slots :
+            entry.slot = self.poll_free_slots.pop ()
+            self.plugin_array[entry.slot] = plugin
+        else :
+            entry.slot = len (self.plugin_array)
+            self.plugin_array.append (plugin)
+        if name is not None :
+            self.poll_names[name] = entry
+        for tag in entry.tags :
+            if tag not in self.poll_tags :
+                self.poll_tags[tag] = {}
+            self.poll_tags[tag][entry.order] = entry
+        if blocking and self.poll_pool is None and _thread is not None :
+            self.poll_pool = PollThreadPool (self.offload_threads)
+        if is_async :
+            self.poll_async_count += 1
+        self.poll_entries[id (plugin)] = entry
+        entry.missed_base = self.poll_missed_cycles
+        if every_cycle :
+            self.poll_added.append (entry)
+        else :
+            if delay_ms is None :
+                delay_ms = 0            # First poll on next cycle
+            self.poll_queue (entry, self.poll_elapsed_us + ms_to_us (delay_ms))
+        if subscribe :
+            for mess_id in subscribe :
+                self.message_subscribe (mess_id, plugin)
+        if io :
+            for fileobj in io :
+                self.io_register (plugin, fileobj)
+        return entry
+    def poll_resolve (self, plugin) :
+        #---- PollEntry of a PollEntry (poll_add handle), plugin or name
+        if isinstance (plugin, PollEntry) :
+            return plugin
+        if isinstance (plugin, str) :
+            return self.poll_names.get (plugin)
+        return self.poll_entries.get (id (plugin))
+    def poll_remove (self, plugin) :
+        #---- plugin: PollEntry (poll_add handle), plugin object or name
+        #---- O(1), the poll loop drops the plugin at the start of the next
+        #---- poll cycle, its shutdown is called in a later cycle (see
+        #---- poll_retire). Returns False if not found or already removed.
+        entry = self.poll_resolve (plugin)
+        if entry is None or entry.removed :
+            return False
+        entry.removed = True
+        if entry.name is not None :
+            del self.poll_names[entry.name]
+        for tag in entry.tags :
+            tagged = self.poll_tags[tag]
+            del tagged[entry.order]
+            if not tagged :
+                del self.poll_tags[tag]
+        self.poll_removed.append (entry)
+        return True
+    def poll_lookup (self, name) :
+        #---- PollEntry of a poll_add name, None if not found
+        return self.poll_names.get (name)
+    def poll_tagged (self, tag) :
+        #---- PollEntry's of a poll_add tag, poll_add order
+        tagged = self.poll_tags.get (tag)
+        if tagged is None :
+            return []
+        return sorted (tagged.values (), key = poll_entry_order)
+    def poll_registry_apply (self) :
+        #---- Cycle start: poll_add (every cycle), poll_remove and fault
+        #---- (suspended, resumed every cycle plugins) changes
+        cycle = self.poll_faulted
+        self.poll_faulted = False
+        removed = self.poll_removed
+        if removed :
+            self.poll_removed = []
+            for entry in removed :
+                self.poll_unregister (entry)
+                cycle = cycle or entry.every_cycle
+            if self.poll_tasks :        # closed by poll_retire
+                self.poll_tasks = [entry for entry in self.poll_tasks
+                                   if not entry.removed]
+                self.poll_task_next = 0
+            if self.poll_deferred :     # scheduled plugins too
+                self.poll_deferred = [entry for entry in self.poll_deferred
+                                      if not entry.removed]
+            self.poll_retiring.extend (removed)
+        #---- One pass per poll cycle, not per removed/suspended plugin
+        if cycle :
+            entries = []
+            for entry in self.poll_cycle_entries :
+                if entry.removed or entry.suspended :
+                    entry.in_cycle = False
+                else :
+                    entries.append (entry)
+            self.poll_cycle_entries = entries
+            if self.poll_deferred :
+                self.poll_deferred = [entry for entry in self.poll_deferred
+                                      if not entry.suspended]
+        added = self.poll_added
+        if added :
+            self.poll_added = []
+            entries = self.poll_cycle_entries
+            resort = False
+            for entry in added :
+                if entry.removed or entry.suspended or entry.in_cycle :
+                    continue
+                if entries and entries[-1].order > entry.order :
+                    resort = True       # resumed plugin (fault_reset)
+                entry.in_cycle = True
+                entries.append (entry)
+            if resort :                 # keep poll_add order
+                entries.sort (key = poll_entry_order)
+    def poll_unregister (self, entry) :
+        plugin = entry.plugin
+        for fileobj in list (entry.io_objects) :
+            self.io_unregister (plugin, fileobj)
+        for mess_id in entry.subscriptions :
+            subscribers = self.message_subscribers.get (mess_id)
+            if subscribers is not None and entry in subscribers :
+                subscribers.remove (entry)
+                if not subscribers :
+                    del self.message_subscribers[mess_id]
+        entry.heap_seq = -1             # queued heap items are stale
+        if self.poll_entries.get (id (plugin)) is entry :
+            del self.poll_entries[id (plugin)]
+        self.plugin_array[entry.slot] = None
+        self.poll_free_slots.append (entry.slot)
+    def poll_retire (self) :
+        #---- Shutdown of one removed plugin per poll cycle. A generator
+        #---- returned by shutdown is run as a task (poll_tasks_run).
+        entry = self.poll_retiring.pop (0)
+        if entry.task is not None :
+            try :
+                entry.task.close ()
+            except :
+                print ("task close", entry.plugin.__class__, "exception")
+            entry.task = None
+        try :
+            result = entry.plugin.shutdown ()
+        except :
+            print ("plugin shutdown", entry.plugin.__class__, "exception")
+            return
+        if isinstance (result, GENERATOR_TYPE) :
+            entry.task = result
+            self.poll_tasks.append (entry)
+    def poll_schedule (self, plugin, delay_ms) :
+        #---- Next poll_it call delay_ms after the current poll time
+        entry = self.poll_entries.get (id (plugin))
+        if entry is None or entry.every_cycle or entry.suspended :
+            return
+        self.poll_queue (entry, self.poll_elapsed_us + ms_to_us (delay_ms))
+    def poll_queue (self, entry, due_us) :
+        self.poll_heap_seq += 1
+        entry.due_us = due_us
+        entry.heap_seq = self.poll_heap_seq     # older heap items are stale
+        heapq.heappush (self.poll_heap, (due_us, self.poll_heap_seq, entry))
+    def poll_queue_now (self, entry) :
+        #---- Event for a scheduled plugin: due now
+        if entry.every_cycle or entry.suspended or entry.removed :
+            return                      # polled anyway, backed off, removed
+        if entry.heap_seq < 0 or entry.due_us > self.poll_elapsed_us :
+            self.poll_queue (entry, self.poll_elapsed_us)
+    def poll_requeue (self, entry) :
+        if entry.heap_seq >= 0 or entry.interval_us <= 0 or entry.suspended \
+                or entry.removed :
+            return          # poll_schedule called, one shot, fault, removed
+        interval_us = entry.interval_us
+        due_us = entry.due_us + interval_us
+        elapsed_us = self.poll_elapsed_us
+        if due_us <= elapsed_us :       # missed deadline(s)
+            missed = (elapsed_us - entry.due_us) // interval_us
+            entry.missed += missed
+            if self.overrun == OVERRUN_REANCHOR :
+                due_us = elapsed_us + interval_us
+            elif self.overrun == OVERRUN_SKIP or missed > self.catchup_max :
+                due_us += missed * interval_us
+            #---- OVERRUN_CATCHUP: due now, polled next cycle
+        self.poll_queue (entry, due_us)
+    def poll_heap_top (self) :
+        heap = self.poll_heap
+        while heap :
+            item = heap[0]
+            if item[2].heap_seq == item[1] :
+                return item
+            heapq.heappop (heap)        # stale
+        return None
+    def poll_due_entries (self) :
+        due_entries = []
+        heap = self.poll_heap
+        while heap and heap[0][0] <= self.poll_elapsed_us :
+            item = heapq.heappop (heap)
+            entry = item[2]
+            if entry.heap_seq == item[1] and not entry.removed :
+                entry.heap_seq = -1
+                entry.late_last_us = self.poll_elapsed_us - entry.due_us
+                if entry.late_last_us > entry.late_max_us :
+                    entry.late_max_us = entry.late_last_us
+                due_entries.append (entry)
+        return due_entries
+    def poll_tickless (self) :
+        #---- No every cycle plugins: sleep until the next deadline
+        #---- Deferred plugins (budget_set), generator tasks and poll_add/
+        #---- poll_remove changes are polled next poll interval
+        return not self.poll_cycle_entries \
+                and not self.poll_deferred \
+                and not self.poll_tasks \
+                and not self.poll_added \
+                and not self.poll_removed \
+                and not self.poll_retiring \
+                and not self.poll_faulted \
+                and self.poll_heap_top () is not None
 
     def poll_start (self) :
-        gc.collect ()
+        if self.poll_async_count > 0 :
+            #---- async plugins have to be awaited
+            asyncio.run (self.poll_start_async ())
+            return
+        self.poll_gc_collect ()
+        self.group_start ()
         try :
         #if True :
             while self.states['running'] :
@@ -114,56 +1745,529 @@ class PollLooper :
             print ("poll_it: exception")
             print (e)
         finally :
-            print ("Poll completed")
-            for plugin in self.plugin_array :
-                try :
-                    plugin.shutdown ()
-                except :
-                    print ("plugin shutdown", plugin.__class__, "exception")
-            print ("That's all folks")
+            self.poll_shutdown_plugins ()
+
+    async def poll_start_async (self) :
+        #---- Run as a task: asyncio.create_task (poller.poll_start_async ())
+        self.use_asyncio = True         # poll_wait returns the sleep time
+        self.poll_gc_collect ()
+        self.group_start ()
+        self.poll_init ()               # Reset poll start time
+        try :
+            while self.states['running'] :
+                await self.poll_plugins_async ()
+                self.poll_wait ()
+                await asyncio.sleep (self.poll_sleep_us / 1000000)
+        except Exception as e :
+            print ("poll_it: exception")
+            print (e)
+        finally :
+            self.poll_shutdown_plugins ()
+
+    def poll_gc_collect (self) :
+        #---- Before polling, measures the first full pause
+        if self.poll_gc is None :
+            gc.collect ()
+        else :
+            self.poll_gc.full ()
+
+    def poll_shutdown_plugins (self) :
+        print ("Poll completed")
+        self.group_stop ()
+        for group in self.poll_groups :
+            if group.group_thread :     # wait for the group's shutdown
+                group.group_done.acquire ()
+        if self.poll_pool is not None :
+            #---- Blocking plugins finish their poll_it before shutdown
+            if not self.poll_pool.stop (POLL_STOP_WAIT_MS) :
+                print ("poll_it: blocking plugins still running")
+            self.poll_offload_collect ()
+        self.poll_waker.close ()
+        if self.poll_trace is not None :
+            self.poll_trace.close (self.trace_names ())
+        for entry in self.poll_tasks :
+            try :
+                if entry.removed :      # poll_retire shutdown task
+                    for _ in entry.task :
+                        pass
+                else :
+                    entry.task.close () # runs the task's finally blocks
+            except :
+                print ("task close", entry.plugin.__class__, "exception")
+            entry.task = None
+        self.poll_tasks = []
+        entries = sorted (self.poll_entries.values (), key = poll_entry_order)
+        for entry in self.poll_retiring + entries :
+            plugin = entry.plugin
+            try :
+                if entry.task is not None :     # removed, task not closed
+                    entry.task.close ()
+                    entry.task = None
+                result = plugin.shutdown ()
+                if isinstance (result, GENERATOR_TYPE) :
+                    for _ in result :
+                        pass
+            except :
+                print ("plugin shutdown", plugin.__class__, "exception")
+        self.poll_retiring = []
+        print ("That's all folks")
 
     def poll_wait (self) :
         #print ("Globals: ======> poll_wait:", time.time())
-        sleep_time_ms = 0
+        sleep_time_us = 0
+        self.poll_sleep_us = 0
         if not self.states['running'] :
             return                  # shutting down
-        self.current_time_ms = time.ticks_ms ()
-        if self.poll_interval_ms <= 0 :
-            self.poll_time_ms = self.current_time_ms
-            return sleep_time_ms    # poll delay controlled externally
+        clock = self.clock
+        waker = self.poll_waker
+        if waker.ready :
+            waker.ready = {}        # last cycle's I/O events
+        current_time_us = clock.ticks_us ()
+        self.current_time_ms = self.poll_time_ms_at (current_time_us)
+        trace = self.poll_trace
+        if trace is not None :
+            trace.cycle_end (current_time_us)
+        if self.poll_interval_us <= 0 :
+            if waker.io :
+                waker.wait_us (0)
+            self.poll_time_set (current_time_us)
+            self.io_dispatch ()
+            return 0                # poll delay controlled externally
+        if self.poll_adaptive is not None :
+            self.poll_interval_set (self.poll_adaptive.cycle (self.poll_time_ms))
+            self.poll_time_next_us = clock.ticks_add (self.poll_time_us,
+                                                     self.poll_interval_us)
         #---- Set poll delay
-        if time.ticks_diff (self.poll_time_next_ms, self.current_time_ms) <= 0 :
-            if self.show_timeout :
+        show_timeout = self.show_timeout
+        overrun = True
+        if self.poll_tickless () :
+            due_us = self.poll_heap_top ()[0] - self.poll_elapsed_us
+            if due_us <= 0 :
+                due_us = 0
+                show_timeout = False    # already due, not an overrun
+                overrun = False
+            elif due_us > POLL_SLEEP_MAX_US :
+                due_us = POLL_SLEEP_MAX_US  # ticks wrap, checked again later
+            self.poll_time_next_us = clock.ticks_add (self.poll_time_us, due_us)
+        if clock.ticks_diff (self.poll_time_next_us, current_time_us) <= 0 :
+            timing = self.poll_timing
+            if timing is not None :
+                timing.cycle_end (0, overrun)
+            if self.catchup_count > 0 :
+                show_timeout = False    # shown at the start of the catch up
+            if show_timeout :
                 print ("poll_wait: too much time: Next" ,
-                        self.poll_time_next_ms ,
-                        "Curr:", self.current_time_ms)
+                        self.poll_time_next_us ,
+                        "Curr:", current_time_us)
+                if timing is not None and timing.cycle_max_entry is not None :
+                    print ("poll_wait: slowest plugin:" ,
+                            timing.cycle_max_entry.plugin.__class__ ,
+                            timing.cycle_max_us, "us")
             else :
                 self.show_timeout = True
-            self.poll_time_ms = self.current_time_ms
+            if waker.io :
+                waker.wait_us (0)       # no sleep, check the I/O only
+            waker.woken ()              # next cycle starts now anyway
+            if trace is not None and overrun :
+                trace.record (TRACE_OVERRUN ,
+                              value = clock.ticks_diff (current_time_us ,
+                                                        self.poll_time_next_us))
+            if overrun :
+                self.poll_overrun (current_time_us)
+            else :
+                self.poll_time_set (current_time_us)
+            self.io_dispatch ()
         else :
+            self.catchup_count = 0
             #print ("Poll loop OK")
-            sleep_time_ms = time.ticks_diff (self.poll_time_next_ms,
-                                            self.current_time_ms)
-            if sleep_time_ms < 0 :
-                sleep_time_ms = 0
-            if not self.use_asyncio :
-                time.sleep_ms (sleep_time_ms)
-            self.poll_time_ms = self.poll_time_next_ms
-        self.poll_time_next_ms = time.ticks_add (self.poll_time_ms,
-                                                self.poll_interval_ms)
-        #print ("ptn:",self.poll_time_next_ms,"pt:",self.poll_time_ms)
-        #print ("sleep_ms:", sleep_time_ms)
-        return sleep_time_ms
+            sleep_time_us = clock.ticks_diff (self.poll_time_next_us,
+                                             current_time_us)
+            if self.poll_timing is not None :
+                self.poll_timing.cycle_end (sleep_time_us, False)
+            if self.poll_gc is not None :
+                self.poll_gc.slack (sleep_time_us)
+                sleep_time_us = clock.ticks_diff (self.poll_time_next_us ,
+                                                 clock.ticks_us ())
+                if sleep_time_us < 0 :
+                    sleep_time_us = 0
+            self.poll_sleep_us = sleep_time_us
+            if trace is not None :
+                trace.record (TRACE_SLEEP, value = sleep_time_us)
+            if self.use_asyncio :
+                if waker.io :
+                    waker.wait_us (0)
+                woken = waker.woken ()
+            else :
+                woken = clock.sleep_us (sleep_time_us, waker)
+                if trace is not None :
+                    trace.record (TRACE_WAKE, value = 1 if woken else 0)
+            if woken :
+                #---- Extra poll cycle now, keep the planned next poll time
+                self.poll_wakeups += 1
+                self.poll_sleep_us = 0
+                self.poll_time_set (clock.ticks_us ())
+                self.io_dispatch ()
+                self.activity ()
+                return 0
+            self.poll_time_set (self.poll_time_next_us)
+        self.poll_time_next_us = clock.ticks_add (self.poll_time_us,
+                                                 self.poll_interval_us)
+        #print ("ptn:",self.poll_time_next_us,"pt:",self.poll_time_us)
+        #print ("sleep_us:", sleep_time_us)
+        return sleep_time_us // 1000
+    def poll_overrun (self, current_time_us) :
+        #---- Set poll time after an overrun, see overrun_policy
+        interval_us = self.poll_interval_us
+        if self.poll_tickless () or interval_us <= 0 :
+            self.poll_time_set (current_time_us)
+            return                      # tickless: scheduled plugins only
+        missed = self.clock.ticks_diff (current_time_us ,
+                                        self.poll_time_next_us) // interval_us
+        if self.overrun == OVERRUN_CATCHUP \
+                and self.catchup_count < self.catchup_max :
+            self.catchup_count += 1     # poll the missed poll time now
+            self.poll_time_set (self.poll_time_next_us)
+            return
+        self.poll_missed_cycles += missed
+        if self.overrun == OVERRUN_REANCHOR :
+            self.poll_time_set (current_time_us)
+        else :                          # skip, catch up limit reached
+            self.catchup_count = 0
+            self.poll_time_set (self.clock.ticks_add (self.poll_time_next_us ,
+                                                      missed * interval_us))
     def poll_plugins (self) :
         #print (__class__)
-        for plugin in self.plugin_array :     # poll each plugin
-            plugin.poll_it ()
+        if self.poll_timing is not None :
+            self.poll_timing.cycle_start ()
+        if self.poll_trace is not None :
+            self.poll_trace.cycle_start ()
+        if self.poll_pool is not None :
+            self.poll_offload_collect ()
+        if self.message_pending :
+            self.message_pending_apply ()
+        if self.poll_added or self.poll_removed or self.poll_faulted :
+            self.poll_registry_apply ()
+        entries = self.poll_cycle_entries
+        if self.poll_heap :
+            due_entries = self.poll_due_entries ()
+            if due_entries :            # keep poll_add order
+                due_entries.extend (entries)
+                due_entries.sort (key = poll_entry_order)
+                entries = due_entries
+        if self.poll_budget_us > 0 :
+            self.poll_budget_plugins (entries)
+        else :
+            for entry in entries :      # poll each plugin
+                self.poll_entry (entry)
+        if self.poll_tasks :
+            self.poll_tasks_run ()
+        if self.poll_retiring :
+            self.poll_retire ()
+    def poll_budget_plugins (self, entries) :
+        #---- Critical plugins first, then the plugins deferred last cycle
+        #---- (oldest first, so none starves), then normal, then low
+        clock = self.clock
+        start_us = clock.ticks_us ()
+        self.poll_budget_start_us = start_us
+        self.poll_budget_cycles += 1
+        mark = self.poll_budget_cycles
+        deferred = self.poll_deferred
+        self.poll_deferred = []
+        for entry in entries :
+            if entry.priority == PRIORITY_CRITICAL :
+                entry.budget_mark = mark
+                self.poll_entry (entry)
+        for entry in deferred :
+            if entry.budget_mark != mark :
+                self.poll_budget_entry (entry, start_us, mark)
+        for priority in (PRIORITY_NORMAL, PRIORITY_LOW) :
+            for entry in entries :
+                if entry.priority == priority and entry.budget_mark != mark :
+                    self.poll_budget_entry (entry, start_us, mark)
+    def poll_budget_entry (self, entry, start_us, mark) :
+        entry.budget_mark = mark        # once per cycle
+        clock = self.clock
+        if clock.ticks_diff (clock.ticks_us (), start_us) \
+                >= self.poll_budget_us :
+            entry.deferrals += 1        # budget spent, poll next cycle
+            self.poll_deferred.append (entry)
+            return
+        self.poll_entry (entry)
+    def poll_entry (self, entry) :
+        timing = self.poll_timing
+        trace = self.poll_trace
+        if timing is None and trace is None :
+            self.poll_call (entry)
+        else :
+            clock = self.clock
+            start_us = clock.ticks_us ()
+            if trace is not None :
+                trace.record (TRACE_ENTER, entry.slot, 0, start_us)
+            self.poll_call (entry)
+            end_us = clock.ticks_us ()
+            time_us = clock.ticks_diff (end_us, start_us)
+            if trace is not None :
+                trace.record (TRACE_EXIT, entry.slot, time_us, end_us)
+            if timing is not None :
+                timing.entry_time (entry, time_us)
+        if not entry.every_cycle :
+            self.poll_requeue (entry)
+    def poll_call (self, entry) :
+        if entry.blocking and self.poll_pool is not None :
+            self.poll_pool.submit (entry)
+        elif entry.is_async :
+            self.poll_awaits.append (self.poll_await (entry))
+        elif entry.task is not None :
+            entry.task_skips += 1       # previous task still running
+        else :
+            try :
+                result = entry.plugin.poll_it ()
+            except Exception as e :
+                if not self.poll_fault (entry, e) :
+                    raise
+                return
+            if entry.fail_streak > 0 :
+                self.poll_recovered (entry)
+            if isinstance (result, GENERATOR_TYPE) :
+                entry.task = result     # resumed by poll_tasks_run
+                self.poll_tasks.append (entry)
+    def poll_fault (self, entry, error) :
+        #---- poll_it exception: the plugin is backed off (exponential
+        #---- delay) and disabled after fault_breaker exceptions in a row.
+        #---- Returns False if not isolated (fault_policy).
+        entry.failures += 1
+        entry.fail_streak += 1
+        entry.last_error = error
+        if not self.fault_isolate :
+            return False
+        print ("poll_it:", entry.plugin.__class__, "exception" ,
+               entry.fail_streak)
+        print (error)
+        if entry.removed :
+            return True
+        if entry.every_cycle and not entry.suspended :
+            self.poll_faulted = True    # out of poll_cycle_entries
+        entry.suspended = True
+        if self.fault_breaker > 0 and entry.fail_streak >= self.fault_breaker :
+            entry.disabled = True       # until fault_reset
+            entry.heap_seq = -1
+            print ("poll_it:", entry.plugin.__class__, "disabled")
+            return True
+        backoff_us = self.fault_backoff_us
+        for _ in range (entry.fail_streak - 1) :
+            backoff_us *= 2
+            if backoff_us >= self.fault_backoff_max_us :
+                break
+        if backoff_us > self.fault_backoff_max_us :
+            backoff_us = self.fault_backoff_max_us
+        entry.backoff_us = backoff_us
+        self.poll_queue (entry, self.poll_elapsed_us + backoff_us)
+        return True
+    def poll_recovered (self, entry) :
+        #---- First poll_it without exception after a fault
+        entry.fail_streak = 0
+        entry.backoff_us = 0
+        if entry.suspended :
+            entry.suspended = False
+            if entry.every_cycle :      # back to every cycle polling
+                self.poll_added.append (entry)
+            else :                      # blocking: not requeued while
+                self.poll_requeue (entry)   # suspended
+    def poll_tasks_run (self) :
+        #---- Resume the generators returned by poll_it, one yield to the
+        #---- next is a slice. entry.slices per cycle, round robin when
+        #---- slice_limit or the budget ends the cycle's slices early.
+        tasks = self.poll_tasks
+        clock = self.clock
+        count = len (tasks)
+        first = self.poll_task_next % count
+        slice_count = 0
+        cut_entry = None
+        for index in range (count) :
+            entry = tasks[(first + index) % count]
+            for _ in range (entry.slices) :
+                if (self.slice_max > 0 and slice_count >= self.slice_max) \
+                    or (self.poll_budget_us > 0
+                        and entry.priority != PRIORITY_CRITICAL
+                        and clock.ticks_diff (clock.ticks_us (),
+                                              self.poll_budget_start_us)
+                            >= self.poll_budget_us) :
+                    cut_entry = entry   # first next cycle
+                    break
+                slice_count += 1
+                if not self.poll_task_slice (entry) :
+                    break
+            if cut_entry is not None :
+                break
+        if slice_count > 0 :
+            tasks = [entry for entry in tasks if entry.task is not None]
+            self.poll_tasks = tasks
+        if cut_entry is not None and cut_entry.task is not None :
+            self.poll_task_next = tasks.index (cut_entry)
+        else :
+            self.poll_task_next = 0
+    def poll_task_slice (self, entry) :
+        #---- Returns False when the task is done
+        timing = self.poll_timing
+        trace = self.poll_trace
+        if timing is not None or trace is not None :
+            clock = self.clock
+            start_us = clock.ticks_us ()
+            if trace is not None :
+                trace.record (TRACE_ENTER, entry.slot, 0, start_us)
+        entry.task_slices += 1
+        try :
+            next (entry.task)
+        except StopIteration :
+            entry.task = None
+        except Exception as e :
+            entry.task = None
+            if not self.poll_fault (entry, e) :
+                raise
+        if timing is not None or trace is not None :
+            end_us = clock.ticks_us ()
+            time_us = clock.ticks_diff (end_us, start_us)
+            if trace is not None :
+                trace.record (TRACE_EXIT, entry.slot, time_us, end_us)
+            if timing is not None :
+                timing.entry_time (entry, time_us)
+        return entry.task is not None
+    def poll_offload_collect (self) :
+        #---- Blocking plugin poll_it may return {mess_id : mess_dict, ...}
+        for entry, result, error in self.poll_pool.collect () :
+            entry.in_flight = False
+            if error is not None :
+                if not self.poll_fault (entry, error) :
+                    print ("poll_it: blocking", entry.plugin.__class__ ,
+                           "exception")
+                    print (error)
+            else :
+                if entry.fail_streak > 0 :
+                    self.poll_recovered (entry)
+                if result is not None :
+                    for mess_id in result :
+                        self.message_set (mess_id, result[mess_id])
+        self.poll_pool.start_jobs ()    # queued while threads were busy
+    async def poll_plugins_async (self) :
+        self.poll_plugins ()
+        if self.poll_awaits :           # run this cycle's async plugins
+            poll_awaits = self.poll_awaits
+            self.poll_awaits = []
+            await asyncio.gather (*poll_awaits)
+    async def poll_await (self, entry) :
+        #---- async plugin poll_it, exceptions isolated as in poll_call
+        try :
+            await entry.plugin.poll_it ()
+        except Exception as e :
+            if not self.poll_fault (entry, e) :
+                raise
+            return
+        if entry.fail_streak > 0 :
+            self.poll_recovered (entry)
 
     def running (self) :
         return self.states['running']
     def shutdown (self) :
         print ("Shutdown requested")
+        self.group_stop ()
+        parent = self.group_parent
+        if parent is not None and parent.running () :
+            parent.shutdown ()          # rate groups stop together
+    def wake (self, arg = None, frame = None) :
+        #---- Usable as IRQ handler (arg: pin) or signal handler
+        self.poll_waker.wake ()
+
+    def group_add (self ,
+                   poll_ms = 100 ,
+                   threaded = True ,
+                   timing = None ,
+                   poll_us = None) :
+        #---- Rate group: a PollLooper with its own poll interval and
+        #---- plugins, started and shut down with this poller. Runs on its
+        #---- own thread, or inside this loop if threads are not available.
+        #---- All groups share message_data (message_lock).
+        if timing is None :
+            timing = self.poll_timing is not None
+        threaded = threaded and _thread is not None
+        if threaded :
+            group = PollLooper (poll_ms ,
+                                timing = timing ,
+                                poll_us = poll_us)
+        else :
+            group = PollLooper (poll_ms ,
+                                timing = timing ,
+                                poll_us = poll_us ,
+                                clock = self.clock)
+        if self.message_lock is None and _thread is not None :
+            self.message_lock = _thread.allocate_lock ()
+        group.message_data = self.message_data
+        group.message_versions = self.message_versions
+        group.message_histories = self.message_histories
+        group.message_history_all = self.message_history_all
+        group.message_lock = self.message_lock
+        group.message_loopers = self.message_loopers
+        self.message_loopers.append (group)
+        group.group_parent = self
+        group.group_thread = threaded
+        self.poll_groups.append (group)
+        if not threaded :
+            self.poll_add (PollGroupRunner (group) ,
+                           interval_ms = group.poll_interval_ms)
+        return group
+    def group_start (self) :
+        for group in self.poll_groups :
+            if group.group_thread and group.group_done is None :
+                group.group_done = _thread.allocate_lock ()
+                group.group_done.acquire ()
+                _thread.start_new_thread (group.group_run, ())
+    def group_run (self) :
+        #---- Rate group thread
+        try :
+            self.poll_init ()           # time spent waiting for the start
+            self.poll_start ()
+        finally :
+            self.group_done.release ()
+    def group_stop (self) :
+        #---- Stop this loop and its rate groups
         self.states['running'] = False
+        self.wake ()
+        for group in self.poll_groups :
+            group.group_stop ()
+
+    def io_register (self, plugin, fileobj, events = POLL_READ) :
+        #---- poll_wait also ends when fileobj is ready, scheduled plugins
+        #---- are polled in the next cycle. One events mask per fileobj.
+        entry = self.poll_entries[id (plugin)]
+        self.poll_waker.register (fileobj, events)
+        if fileobj not in self.io_entries :
+            self.io_entries[fileobj] = []
+        if entry not in self.io_entries[fileobj] :
+            self.io_entries[fileobj].append (entry)
+            entry.io_objects.append (fileobj)
+    def io_unregister (self, plugin, fileobj) :
+        entries = self.io_entries.get (fileobj)
+        if entries is None :
+            return
+        entry = self.poll_entries[id (plugin)]
+        if entry in entries :
+            entries.remove (entry)
+            entry.io_objects.remove (fileobj)
+        if not entries :
+            del self.io_entries[fileobj]
+            self.poll_waker.unregister (fileobj)
+    def io_ready (self, fileobj) :
+        #---- POLL_READ/POLL_WRITE events of this poll cycle, 0: not ready
+        return self.poll_waker.ready.get (fileobj, 0)
+    def io_dispatch (self) :
+        ready = self.poll_waker.ready
+        if not ready :
+            return
+        self.activity ()
+        for fileobj in ready :
+            entries = self.io_entries.get (fileobj)
+            if entries :
+                for entry in entries :
+                    self.poll_queue_now (entry)
 
     def seconds_to_ms (self, interval_seconds) :
         return round (interval_seconds * 1000)
@@ -173,36 +2277,415 @@ class PollLooper :
         return self.minutes_to_ms (interval_hours) * 60
     def get_current_time_ms (self) :
         return self.current_time_ms
+    def get_current_time_us (self) :
+        return self.poll_time_us
+    def elapsed_ms (self, since_ms) :
+        #---- since_ms: get_current_time_ms () or active_next_ms () value
+        return time.ticks_diff (self.current_time_ms, since_ms)
     def allow_timeout (self) :
         self.show_timeout = False
+    def overrun_policy (self, policy, catchup_max = 10) :
+        #---- OVERRUN_REANCHOR, OVERRUN_SKIP or OVERRUN_CATCHUP
+        if policy not in (OVERRUN_REANCHOR, OVERRUN_SKIP, OVERRUN_CATCHUP) :
+            raise ValueError ("overrun_policy: " + str (policy))
+        self.overrun = policy
+        self.catchup_max = catchup_max
+        self.catchup_count = 0
+    def budget_set (self, budget_ms) :
+        #---- Plugin time per cycle, 0: no budget (poll_add order)
+        #---- Plugins not polled when the budget is spent are deferred
+        self.poll_budget_us = ms_to_us (budget_ms)
+        if self.poll_budget_us <= 0 :
+            deferred = self.poll_deferred
+            self.poll_deferred = []
+            for entry in deferred :     # don't lose scheduled plugins
+                self.poll_queue_now (entry)
+    def slice_limit (self, max_slices) :
+        #---- Generator task slices per cycle (all plugins), 0: no limit
+        self.slice_max = max_slices
+    def poll_missed (self, plugin) :
+        #---- (missed deadlines, last lateness us, max lateness us)
+        entry = self.poll_entries[id (plugin)]
+        missed = entry.missed
+        if entry.every_cycle :
+            missed += self.poll_missed_cycles - entry.missed_base
+        return (missed, entry.late_last_us, entry.late_max_us)
+
+    def fault_policy (self ,
+                      backoff_ms = 100 ,
+                      backoff_max_ms = 60000 ,
+                      breaker = 10 ,
+                      isolate = True) :
+        #---- poll_it exceptions: the plugin is polled again after
+        #---- backoff_ms, doubled per exception in a row up to backoff_max_ms.
+        #---- breaker exceptions in a row disable it (0: never).
+        #---- isolate = False: an exception ends the poll loop.
+        self.fault_backoff_us = ms_to_us (backoff_ms)
+        self.fault_backoff_max_us = ms_to_us (backoff_max_ms)
+        self.fault_breaker = breaker
+        self.fault_isolate = isolate
+    def fault_reset (self, plugin) :
+        #---- Poll a backed off or disabled plugin again (next cycle)
+        entry = self.poll_resolve (plugin)
+        if entry is None or entry.removed :
+            return False
+        entry.fail_streak = 0
+        entry.backoff_us = 0
+        entry.disabled = False
+        if entry.suspended :
+            entry.suspended = False
+            if entry.every_cycle :
+                entry.heap_seq = -1     # queued retry is stale
+                self.poll_added.append (entry)
+            else :
+                self.poll_queue (entry, self.poll_elapsed_us)
+        return True
+    def fault_stats (self, plugin = None) :
+        #---- Failures of a plugin (PollEntry, plugin or name), None: list
+        #---- of all plugins with failures
+        if plugin is None :
+            return [self.fault_stats (entry) for entry
+                    in sorted (self.poll_entries.values (),
+                               key = poll_entry_order)
+                    if entry.failures > 0]
+        entry = self.poll_resolve (plugin)
+        if entry is None :
+            return None
+        return {"plugin" : entry.plugin.__class__.__name__ ,
+                "name" : entry.name ,
+                "failures" : entry.failures ,
+                "streak" : entry.fail_streak ,
+                "backoff_ms" : entry.backoff_us // 1000 ,
+                "suspended" : entry.suspended ,
+                "disabled" : entry.disabled ,
+                "last_error" : None if entry.last_error is None
+                                else repr (entry.last_error)}
+    def timing_enable (self, enable = True) :
+        if not enable :
+            self.poll_timing = None
+        elif self.poll_timing is None :
+            self.poll_timing = PollTiming (self.clock)
+    def checkpoint_enable (self ,
+                           path ,
+                           interval_ms = 10000 ,
+                           chunk = 512 ,
+                           restore = True) :
+        #---- Call before the plugins are created. Restores message_data
+        #---- from path (returns True if restored), then writes a checkpoint
+        #---- every interval_ms if message_data changed, and at shutdown.
+        checkpoint = PollCheckpoint (self, path, chunk)
+        restored = False
+        if restore :
+            restored = self.checkpoint_restore (checkpoint)
+        self.poll_checkpoint = checkpoint
+        self.poll_add (checkpoint ,
+                       interval_ms = interval_ms ,
+                       delay_ms = interval_ms ,
+                       priority = PRIORITY_LOW)
+        return restored
+    def checkpoint_restore (self, checkpoint) :
+        messages = checkpoint.restore ()
+        if messages is None :
+            return False
+        for mess_id in messages :
+            self.message_data[mess_id] = messages[mess_id]
+            self.message_touch (mess_id)
+        checkpoint.saved = dict (self.message_versions)
+        return True
+    def checkpoint_save (self) :
+        #---- Write a complete checkpoint now
+        self.poll_checkpoint.save ()
+    def checkpoint_stats (self) :
+        return self.poll_checkpoint.stats ()
+
+    def trace_enable (self, records = 4096, path = None) :
+        #---- Binary trace of cycle and plugin events, see PollTracer
+        #---- path: memory mapped (python3), saved at shutdown
+        self.trace_disable ()
+        self.poll_trace = PollTracer (self.clock, records, path)
+        return self.poll_trace
+    def trace_disable (self) :
+        trace = self.poll_trace
+        self.poll_trace = None
+        if trace is not None :
+            trace.close (self.trace_names ())
+    def trace_save (self, path) :
+        #---- Write the current trace, e.g. when memory mapping isn't available
+        self.poll_trace.save (path, self.trace_names ())
+    def trace_names (self) :
+        #---- Plugin class names by slot (trace records), "": free slot
+        return ["" if plugin is None else plugin.__class__.__name__
+                for plugin in self.plugin_array]
+    def poll_stats (self, reset = False) :
+        #---- Cycle and per plugin timing, None if timing is not enabled
+        timing = self.poll_timing
+        if timing is None :
+            return None
+        plugins = []
+        for entry in sorted (self.poll_entries.values (),
+                             key = poll_entry_order) :
+            plugin = entry.plugin
+            missed = self.poll_missed (plugin)
+            stats = {"plugin" : plugin.__class__.__name__ ,
+                     "order" : entry.order ,
+                     "name" : entry.name ,
+                     "overruns" : entry.overruns ,
+                     "offload_skips" : entry.offload_skips ,
+                     "priority" : entry.priority ,
+                     "deferrals" : entry.deferrals ,
+                     "task_slices" : entry.task_slices ,
+                     "task_skips" : entry.task_skips ,
+                     "failures" : entry.failures ,
+                     "disabled" : entry.disabled ,
+                     "missed" : missed[0] ,
+                     "late_max_us" : missed[2]}
+            if entry.histogram is not None :
+                stats["poll_it"] = entry.histogram.summary ()
+                if reset :
+                    entry.histogram.reset ()
+            if reset :
+                entry.overruns = 0
+            plugins.append (stats)
+        stats = {"cycles" : timing.cycles ,
+                 "overruns" : timing.overruns ,
+                 "missed_cycles" : self.poll_missed_cycles ,
+                 "busy" : timing.busy.summary () ,
+                 "slack" : timing.slack.summary () ,
+                 "jitter" : timing.jitter.summary () ,
+                 "plugins" : plugins}
+        if self.poll_gc is not None :
+            stats["gc"] = self.gc_stats ()
+        if self.poll_groups :
+            stats["groups"] = [group.poll_stats (reset)
+                               for group in self.poll_groups]
+        if reset :
+            timing.reset ()
+        return stats
+
+    def poll_interval_set (self, interval_us) :
+        self.poll_interval_us = interval_us
+        self.poll_interval_ms = interval_us / 1000
+    def adaptive_enable (self ,
+                         min_ms ,
+                         max_ms ,
+                         idle_cycles = 10) :
+        #---- Poll interval between min_ms (activity) and max_ms (idle)
+        self.poll_adaptive = PollAdaptive (ms_to_us (min_ms) ,
+                                           ms_to_us (max_ms) ,
+                                           idle_cycles)
+        self.poll_interval_set (self.poll_adaptive.interval_us)
+    def adaptive_disable (self) :
+        self.poll_adaptive = None
+        self.poll_interval_set (self.poll_fixed_us)
+    def adaptive_stats (self) :
+        if self.poll_adaptive is None :
+            return None
+        return self.poll_adaptive.stats ()
+    def activity (self) :
+        #---- Called by plugins on input changes or work done
+        if self.poll_adaptive is not None :
+            self.poll_adaptive.active = True
+
+    def gc_enable (self ,
+                   interval_ms = 5000 ,
+                   auto = True) :
+        #---- Full gc every interval_ms, in the slack time before the next poll
+        self.poll_gc = PollGC (self.clock, ms_to_us (interval_ms), auto)
+    def gc_disable (self) :
+        self.poll_gc = None
+        gc.enable ()
+    def gc_stats (self) :
+        if self.poll_gc is None :
+            return None
+        return self.poll_gc.stats ()
 
     def active_next_ms (self, interval_ms) :
         return time.ticks_add (self.poll_time_ms, interval_ms)
     def active_now (self, next_active_ms) :
         return time.ticks_diff (self.poll_time_ms, next_active_ms) >= 0
+    def active_next_us (self, interval_us) :
+        return self.clock.ticks_add (self.poll_time_us, interval_us)
+    def active_now_us (self, next_active_us) :
+        return self.clock.ticks_diff (self.poll_time_us, next_active_us) >= 0
 
     def message_set (self, mess_id, mess_dict) :
-        if not mess_id in self.message_data :        # New
-            self.message_data[mess_id] = mess_dict
-        else :                                       # Update
-            for mess_key in mess_dict :
-                self.message_data[mess_id][mess_key] = mess_dict[mess_key]
-        self.message_data[mess_id]["last_update_ms"] = self.current_time_ms
+        lock = self.message_lock
+        if lock is not None :
+            lock.acquire ()
+        try :
+            if not mess_id in self.message_data :        # New
+                self.message_data[mess_id] = mess_dict
+            else :                                       # Update
+                for mess_key in mess_dict :
+                    self.message_data[mess_id][mess_key] = mess_dict[mess_key]
+            self.message_data[mess_id]["last_update_ms"] = self.current_time_ms
+            if self.message_histories and mess_id in self.message_histories :
+                self.message_record (mess_id, mess_dict)
+        finally :
+            if lock is not None :
+                lock.release ()
+        self.message_touch (mess_id)
         return self.message_data[mess_id]
     def message_get (self, mess_id) :
+        #---- Rate groups: changing the dictionary in place isn't thread
+        #---- safe, use message_set/message_set_entry or message_snapshot
         if not mess_id in self.message_data :
-            self.message_data[mess_id] = {}
+            lock = self.message_lock
+            if lock is not None :
+                lock.acquire ()
+            if not mess_id in self.message_data :
+                self.message_data[mess_id] = {}
+            if lock is not None :
+                lock.release ()
         return self.message_data[mess_id]
     def message_set_entry (self, mess_id, entry_id, entry_value) :
-        if not mess_id in self.message_data :       # new
-            self.message_data[mess_id] = {}
-        self.message_data[mess_id][entry_id] = entry_value
-        self.message_data[mess_id]["last_update_ms"] = self.current_time_ms
+        lock = self.message_lock
+        if lock is not None :
+            lock.acquire ()
+        try :
+            if not mess_id in self.message_data :       # new
+                self.message_data[mess_id] = {}
+            self.message_data[mess_id][entry_id] = entry_value
+            self.message_data[mess_id]["last_update_ms"] = self.current_time_ms
+            if self.message_histories and mess_id in self.message_histories :
+                self.message_record (mess_id, {entry_id : entry_value})
+        finally :
+            if lock is not None :
+                lock.release ()
+        self.message_touch (mess_id)
     def message_get_entry (self, mess_id, entry_id) :
         if not mess_id in self.message_data :
             return None
         if not entry_id in self.message_data[mess_id] :
             return None
         return self.message_data[mess_id][entry_id]
+    def message_snapshot (self, mess_id) :
+        #---- Consistent copy of global data, None if not set
+        lock = self.message_lock
+        if lock is not None :
+            lock.acquire ()
+        mess_dict = self.message_data.get (mess_id)
+        if mess_dict is not None :
+            mess_dict = dict (mess_dict)
+        if lock is not None :
+            lock.release ()
+        return mess_dict
+
+    def message_touch (self, mess_id) :
+        #---- Call after changing a message_get dictionary in place
+        versions = self.message_versions
+        lock = self.message_lock
+        if lock is None :
+            versions[mess_id] = versions.get (mess_id, 0) + 1
+        else :
+            lock.acquire ()
+            try :
+                versions[mess_id] = versions.get (mess_id, 0) + 1
+            finally :
+                lock.release ()
+            for looper in self.message_loopers :
+                if looper is not self \
+                        and mess_id in looper.message_subscribers :
+                    looper.message_notify (mess_id)
+        if self.poll_adaptive is not None :
+            self.poll_adaptive.active = True
+        subscribers = self.message_subscribers.get (mess_id)
+        if subscribers :
+            for entry in subscribers :
+                self.poll_queue_now (entry)     # poll next cycle
+    def message_notify (self, mess_id) :
+        #---- mess_id changed by another rate group, any thread
+        lock = self.message_lock
+        lock.acquire ()
+        self.message_pending.append (mess_id)
+        lock.release ()
+        self.wake ()
+    def message_pending_apply (self) :
+        lock = self.message_lock
+        lock.acquire ()
+        pending = self.message_pending
+        self.message_pending = []
+        lock.release ()
+        for mess_id in pending :
+            subscribers = self.message_subscribers.get (mess_id)
+            if subscribers :
+                for entry in subscribers :
+                    self.poll_queue_now (entry)
+    def message_record (self, mess_id, mess_dict) :
+        #---- Add the set values to the entry histories
+        histories = self.message_histories[mess_id]
+        config = self.message_history_all.get (mess_id)
+        now_ms = self.current_time_ms
+        for entry_id in mess_dict :
+            history = histories.get (entry_id)
+            if history is None :
+                if config is None or entry_id == "last_update_ms" :
+                    continue
+                history = PollHistory (config[0], config[1])
+                histories[entry_id] = history
+            history.add (now_ms, mess_dict[entry_id])
+    def message_history (self ,
+                         mess_id ,
+                         entry_id = None ,
+                         capacity = 64 ,
+                         typecode = None) :
+        #---- Keep the last capacity (tick_ms, value) of an entry set by
+        #---- message_set/message_set_entry, entry_id None: all entries of
+        #---- mess_id. typecode (e.g. "f"): numbers in an array.
+        #---- Returns the entry's PollHistory (None for all entries).
+        if mess_id not in self.message_histories :
+            self.message_histories[mess_id] = {}
+        histories = self.message_histories[mess_id]
+        mess_dict = self.message_data.get (mess_id)
+        if mess_dict is None :
+            mess_dict = {}
+        tick_ms = mess_dict.get ("last_update_ms", self.current_time_ms)
+        if entry_id is None :
+            self.message_history_all[mess_id] = (capacity, typecode)
+            entry_ids = [entry_id for entry_id in mess_dict
+                         if entry_id != "last_update_ms"]
+        else :
+            entry_ids = [entry_id]
+        for key in entry_ids :
+            if key not in histories :
+                histories[key] = PollHistory (capacity, typecode)
+                if key in mess_dict :   # current value
+                    histories[key].add (tick_ms, mess_dict[key])
+        if entry_id is None :
+            return None
+        return histories[entry_id]
+    def message_history_get (self, mess_id, entry_id) :
+        #---- PollHistory of an entry, None if not kept
+        histories = self.message_histories.get (mess_id)
+        if histories is None :
+            return None
+        return histories.get (entry_id)
+    def message_stale (self, mess_id, max_age_ms, entry_id = None) :
+        #---- True if not set (message_set/message_set_entry) for more than
+        #---- max_age_ms or never. entry_id needs message_history, else
+        #---- the last update of mess_id is checked.
+        if entry_id is not None :
+            history = self.message_history_get (mess_id, entry_id)
+            if history is not None :
+                return history.stale (self.current_time_ms, max_age_ms)
+        mess_dict = self.message_data.get (mess_id)
+        if mess_dict is None or "last_update_ms" not in mess_dict :
+            return True
+        return time.ticks_diff (self.current_time_ms ,
+                                mess_dict["last_update_ms"]) > max_age_ms
+    def message_version (self, mess_id) :
+        return self.message_versions.get (mess_id, 0)
+    def message_changed (self, mess_id, version) :
+        return self.message_versions.get (mess_id, 0) != version
+    def message_subscribe (self, mess_id, plugin) :
+        #---- Scheduled plugins are also polled when mess_id changes
+        entry = self.poll_entries[id (plugin)]
+        if entry.every_cycle :
+            return                      # polled anyway
+        if mess_id not in self.message_subscribers :
+            self.message_subscribers[mess_id] = []
+        if entry not in self.message_subscribers[mess_id] :
+            self.message_subscribers[mess_id].append (entry)
+            entry.subscriptions.append (mess_id)
 
 # end PollLooper
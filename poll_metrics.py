@@ -0,0 +1,313 @@
+#
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# poll_metrics.py - PollLooper health metrics over HTTP/UDP
+#
+# class PollMetrics
+#   methods:
+#     __init__
+#     poll_it - Accept, read requests and send responses, never blocks
+#     shutdown - Close the sockets
+#     metrics - Returns the metrics dictionary
+#     metrics_text - Returns the metrics in Prometheus text format
+#
+################################################################################
+#
+
+try :
+    import usocket as socket
+except :
+    import socket
+
+try :
+    import ujson as json
+except :
+    import json
+
+try :
+    import uerrno as errno
+except :
+    import errno
+
+from poll_looper import POLL_READ, POLL_WRITE
+
+HTTP_OK = "HTTP/1.0 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n" \
+          "Connection: close\r\n\r\n"
+HTTP_BAD = b"HTTP/1.0 400 Bad Request\r\nContent-Length: 0\r\n" \
+           b"Connection: close\r\n\r\n"
+SUMMARY_KEYS = ("count", "mean_us", "p50_us", "p99_us", "max_us")
+WOULD_BLOCK = (errno.EAGAIN, getattr (errno, "EWOULDBLOCK", errno.EAGAIN))
+
+#---------------------------------------------------------------------------
+# PollMetricsClient - One HTTP connection: read request, send response
+#---------------------------------------------------------------------------
+class PollMetricsClient :
+
+    def __init__ (self, sock, start_ms) :
+        self.sock = sock
+        self.start_ms = start_ms
+        self.request = b""
+        self.response = None            # memoryview, set when complete
+        self.sent = 0
+        self.write_wait = False         # registered POLL_WRITE, send blocked
+
+# end PollMetricsClient
+
+#---------------------------------------------------------------------------
+# PollMetrics - Serves the poller statistics, polled by the poll loop
+#   o HTTP (host, port): GET /metrics Prometheus text, any other path
+#     JSON. UDP (udp_port): any datagram is answered with compact JSON.
+#   o Non blocking sockets registered with io_register: add with an
+#     interval (e.g. poll_add (metrics, interval_ms = 1000)), requests
+#     poll it right away
+#   o Work per poll_it is bounded: one accept, one recv and one send of
+#     at most chunk bytes per connection. A response is sent one chunk
+#     per poll interval, the socket is registered for POLL_WRITE only
+#     when a send would block. Slow clients time out.
+#   o Enable poller timing (timing_enable) for the cycle/plugin times
+#---------------------------------------------------------------------------
+class PollMetrics :
+
+    def __init__ (self ,
+                  poller ,
+                  port = 8080 ,
+                  host = "127.0.0.1" ,
+                  udp_port = None ,
+                  chunk = 512 ,         # bytes per send
+                  max_clients = 4 ,
+                  timeout_ms = 5000 ,
+                  request_max = 1024) :
+        self.poller = poller
+        self.chunk = chunk
+        self.max_clients = max_clients
+        self.timeout_ms = timeout_ms
+        self.request_max = request_max
+        self.clients = []
+        self.requests = 0
+        self.registered = False         # io_register on the first poll_it
+        self.accepting = True           # server registered, client slot free
+        self.server = None
+        self.udp = None
+        if port is not None :
+            self.server = socket.socket (socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt (socket.SOL_SOCKET ,
+                                    socket.SO_REUSEADDR, 1)
+            self.server.bind (socket.getaddrinfo (host, port)[0][-1])
+            self.server.listen (2)
+            self.server.setblocking (False)
+        if udp_port is not None :
+            self.udp = socket.socket (socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind (socket.getaddrinfo (host, udp_port)[0][-1])
+            self.udp.setblocking (False)
+
+    def poll_it (self) :
+        poller = self.poller
+        if not self.registered :
+            self.registered = True
+            for sock in (self.server, self.udp) :
+                if sock is not None :
+                    poller.io_register (self, sock)
+        if self.server is not None and len (self.clients) < self.max_clients :
+            try :
+                sock, address = self.server.accept ()
+                sock.setblocking (False)
+                self.clients.append (
+                    PollMetricsClient (sock, poller.get_current_time_ms ()))
+                poller.io_register (self, sock)
+            except OSError :
+                pass                    # no connection waiting
+            if len (self.clients) >= self.max_clients :
+                #---- Waiting connections would end every poll_wait sleep
+                self.accepting = False
+                poller.io_unregister (self, self.server)
+        if self.udp is not None :
+            try :
+                data, address = self.udp.recvfrom (64)
+                self.requests += 1
+                self.udp.sendto (json.dumps (self.metrics (False)).encode () ,
+                                 address)
+            except OSError :
+                pass
+        for client in list (self.clients) :
+            self.client_poll (client)
+
+    def client_poll (self, client) :
+        poller = self.poller
+        if poller.elapsed_ms (client.start_ms) > self.timeout_ms :
+            self.client_close (client)
+            return
+        try :
+            if client.response is None :
+                data = client.sock.recv (self.chunk)
+                if not data :
+                    self.client_close (client)
+                    return
+                client.request += data
+                if b"\r\n\r\n" in client.request \
+                        or len (client.request) > self.request_max :
+                    client.response = memoryview (self.respond (client.request))
+                    poller.io_unregister (self, client.sock)
+                else :
+                    return
+            client.sent += client.sock.send (
+                client.response[client.sent:client.sent + self.chunk])
+            if client.sent >= len (client.response) :
+                self.client_close (client)
+                return
+            if client.write_wait :      # writable again
+                client.write_wait = False
+                poller.io_unregister (self, client.sock)
+            #---- Next chunk next poll interval, a writable socket would end
+            #---- every poll_wait sleep
+            poller.poll_schedule (self, poller.poll_interval_us / 1000)
+        except OSError as e :
+            if e.args and e.args[0] in WOULD_BLOCK :
+                if client.response is not None and not client.write_wait :
+                    client.write_wait = True    # polled when writable
+                    poller.io_register (self, client.sock, POLL_WRITE)
+                return
+            self.client_close (client)
+
+    def client_close (self, client) :
+        self.poller.io_unregister (self, client.sock)
+        client.sock.close ()
+        self.clients.remove (client)
+        if not self.accepting and self.server is not None :
+            self.accepting = True
+            self.poller.io_register (self, self.server)
+
+    def respond (self, request) :
+        line = request.split (b"\r\n", 1)[0].split ()
+        if len (line) < 2 or line[0] != b"GET" :
+            return HTTP_BAD
+        self.requests += 1
+        if line[1].startswith (b"/metrics") :
+            body = self.metrics_text ().encode ()
+            content_type = "text/plain; version=0.0.4"
+        else :
+            body = json.dumps (self.metrics ()).encode ()
+            content_type = "application/json"
+        return (HTTP_OK % (content_type, len (body))).encode () + body
+
+    def metrics (self, full = True) :
+        #---- full = False: summaries without histograms (UDP datagram)
+        poller = self.poller
+        messages = {}
+        for mess_id in poller.message_data :
+            messages[mess_id] = {"entries" : len (poller.message_data[mess_id]) ,
+                                 "version" : poller.message_version (mess_id)}
+        metrics = {"poll_interval_us" : poller.poll_interval_us ,
+                   "plugins" : len (poller.poll_entries) ,
+                   "wakeups" : poller.poll_wakeups ,
+                   "requests" : self.requests ,
+                   "messages" : messages}
+        stats = poller.poll_stats ()
+        if stats is not None :
+            if not full :
+                stats = self.compact (stats)
+            metrics["timing"] = stats
+        elif poller.poll_gc is not None :
+            metrics["gc"] = poller.gc_stats ()
+        return metrics
+
+    def compact (self, stats) :
+        compact = {}
+        for key in stats :
+            value = stats[key]
+            if isinstance (value, dict) and "buckets" in value :
+                value = dict ((summary_key, value[summary_key])
+                              for summary_key in SUMMARY_KEYS)
+            elif key == "plugins" :
+                value = [{"plugin" : plugin["plugin"] ,
+                          "poll_it" : self.compact (plugin).get ("poll_it")}
+                         for plugin in value]
+            elif isinstance (value, dict) :
+                value = self.compact (value)
+            compact[key] = value
+        return compact
+
+    def metrics_text (self) :
+        #---- Prometheus text exposition format
+        metrics = self.metrics ()
+        lines = ["poll_interval_us %d" % metrics["poll_interval_us"] ,
+                 "poll_plugins %d" % metrics["plugins"] ,
+                 "poll_wakeups_total %d" % metrics["wakeups"] ,
+                 "poll_metrics_requests_total %d" % metrics["requests"]]
+        messages = metrics["messages"]
+        for mess_id in messages :
+            lines.append ('poll_message_entries{id="%s"} %d'
+                            % (mess_id, messages[mess_id]["entries"]))
+            lines.append ('poll_message_version{id="%s"} %d'
+                            % (mess_id, messages[mess_id]["version"]))
+        stats = metrics.get ("timing")
+        if stats is not None :
+            lines.append ("poll_cycles_total %d" % stats["cycles"])
+            lines.append ("poll_overruns_total %d" % stats["overruns"])
+            lines.append ("poll_missed_cycles_total %d"
+                            % stats["missed_cycles"])
+            for name in ("busy", "slack", "jitter") :
+                self.summary_lines (lines, "poll_" + name + "_us" ,
+                                    "", stats[name])
+            for plugin in stats["plugins"] :
+                labels = 'plugin="%s",order="%d",' % (plugin["plugin"] ,
+                                                      plugin["order"])
+                if "poll_it" in plugin :
+                    self.summary_lines (lines, "poll_plugin_us" ,
+                                        labels, plugin["poll_it"])
+                lines.append ("poll_plugin_overruns_total{%s} %d"
+                                % (labels[:-1], plugin["overruns"]))
+            gc_stats = stats.get ("gc")
+        else :
+            gc_stats = metrics.get ("gc")
+        if gc_stats is not None :
+            lines.append ("poll_gc_full_total %d" % gc_stats["full"])
+            lines.append ("poll_gc_deferred_total %d" % gc_stats["deferred"])
+            self.summary_lines (lines, "poll_gc_pause_us" ,
+                                "", gc_stats["pause"])
+        return "\n".join (lines) + "\n"
+
+    def summary_lines (self, lines, name, labels, summary) :
+        for quantile, key in (("0.5", "p50_us"), ("0.99", "p99_us")) :
+            lines.append ('%s{%squantile="%s"} %d'
+                            % (name, labels, quantile, summary[key]))
+        lines.append ("%s_count%s %d" % (name ,
+                                         "{" + labels[:-1] + "}" if labels
+                                         else "" ,
+                                         summary["count"]))
+        lines.append ("%s_max%s %d" % (name ,
+                                       "{" + labels[:-1] + "}" if labels
+                                       else "" ,
+                                       summary["max_us"]))
+
+    def shutdown (self) :
+        self.accepting = True           # no io_register by client_close
+        for client in list (self.clients) :
+            self.client_close (client)
+        for sock in (self.server, self.udp) :
+            if sock is not None :
+                self.poller.io_unregister (self, sock)
+                sock.close ()
+
+# end PollMetrics
@@ -0,0 +1,222 @@
+#
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# poll_sampler.py - Sampling plugin base class for PollLooper
+#
+# class PollSampler
+#   methods:
+#     __init__
+#     poll_it - Reads a sample, calls process when a batch is complete
+#     shutdown - Plugin shutdown
+#     read_sample - Returns a sample or None (subclass)
+#     process - Batch processing of new samples (subclass)
+#     add - Add one sample (decimation/averaging)
+#     add_block - Add a block of samples (numpy vectorized)
+#     window - Returns the last count samples, zero copy
+#     window_new - Returns the samples added since the last window_new
+#     window_stats - Returns (min, max, mean) of the last count samples
+#     sample_count - Returns the number of samples in the buffer
+#
+################################################################################
+#
+
+from array import array
+
+try :
+    import numpy                    # python3: vectorized add_block, stats
+except :
+    numpy = None
+
+#---------------------------------------------------------------------------
+# PollSampler - Preallocated ring buffer sampling plugin
+#   o Subclass and override read_sample and/or process, or feed samples
+#     with add/add_block from poll_it of another plugin
+#   o array.array ring buffer, windows are memoryview slices of the
+#     buffer (no copy). A window that wraps is two slices (first, second),
+#     oldest samples first, second is empty if the window doesn't wrap.
+#   o decimate = n: one sample is kept of n samples added, with
+#     average = True the mean of the n samples is kept
+#   o batch: process is called with the new samples every batch samples
+#   o add doesn't allocate memory (integer typecodes)
+#---------------------------------------------------------------------------
+class PollSampler :
+
+    def __init__ (self ,
+                  poller ,
+                  size = 256 ,          # ring buffer samples
+                  typecode = 'f' ,      # array typecode
+                  decimate = 1 ,
+                  average = False ,
+                  batch = 0 ,           # 0: size // 2
+                  use_numpy = True) :
+        self.poller = poller
+        self.size = size
+        self.typecode = typecode
+        self.is_float = typecode in ('f', 'd')
+        self.buffer = array (typecode, [0] * size)
+        self.view = memoryview (self.buffer)
+        self.empty = self.view[0:0]
+        self.head = 0                   # next write index
+        self.count = 0                  # samples stored, doesn't wrap
+        self.done_count = 0             # count at the last window_new
+        self.overruns = 0               # samples lost before window_new
+        self.decimate = decimate
+        self.average = average
+        self.dec_count = 0              # samples added to the current group
+        self.dec_sum = 0
+        if batch <= 0 :
+            batch = size // 2
+        self.batch = batch
+        self.np_buffer = None
+        if use_numpy and numpy is not None :
+            self.np_buffer = numpy.frombuffer (self.buffer ,
+                                               dtype = numpy.dtype (typecode))
+
+    def poll_it (self) :
+        value = self.read_sample ()
+        if value is not None :
+            self.add (value)
+        if self.count - self.done_count >= self.batch :
+            first, second = self.window_new ()
+            self.process (first, second)
+
+    def shutdown (self) :
+        pass
+
+    def read_sample (self) :
+        #---- Read the sensor/ADC here, None: no sample
+        return None
+
+    def process (self, first, second) :
+        #---- New samples: first then second, oldest first
+        pass
+
+    def add (self, value) :
+        if self.decimate > 1 :
+            self.dec_count += 1
+            if self.average :
+                self.dec_sum += value
+            if self.dec_count < self.decimate :
+                return
+            if self.average :
+                if self.is_float :
+                    value = self.dec_sum / self.decimate
+                else :
+                    value = self.dec_sum // self.decimate
+                self.dec_sum = 0
+            self.dec_count = 0
+        self.buffer[self.head] = value
+        self.head += 1
+        if self.head >= self.size :
+            self.head = 0
+        self.count += 1
+
+    def add_block (self, values) :
+        #---- Sequence, array or memoryview of samples
+        np_buffer = self.np_buffer
+        if np_buffer is None :
+            for value in values :
+                self.add (value)
+            return
+        values = numpy.asarray (values)
+        start = 0
+        decimate = self.decimate
+        if decimate > 1 :
+            while self.dec_count > 0 and start < len (values) :
+                self.add (values[start])   # complete the current group
+                start += 1
+            groups = (len (values) - start) // decimate
+            end = start + groups * decimate
+            block = values[start:end]
+            if self.average :
+                block = block.reshape (groups, decimate).sum (axis = 1)
+                if self.is_float :
+                    block = block / decimate
+                else :
+                    block = block // decimate
+            else :
+                block = block[decimate - 1::decimate]
+        else :
+            end = len (values)
+            block = values
+        #---- Keep the newest size samples, copy with at most two slices
+        if len (block) > self.size :
+            dropped = len (block) - self.size
+            self.head = (self.head + dropped) % self.size
+            self.count += dropped
+            block = block[-self.size:]
+        count = len (block)
+        part = min (count, self.size - self.head)
+        np_buffer[self.head:self.head + part] = block[:part]
+        np_buffer[:count - part] = block[part:]
+        self.head = (self.head + count) % self.size
+        self.count += count
+        for index in range (end, len (values)) :
+            self.add (values[index])    # incomplete last group
+
+    def window (self, count) :
+        #---- Last count samples as (first, second) memoryview slices
+        count = min (count, self.sample_count ())
+        start = self.head - count
+        if start >= 0 :
+            return (self.view[start:self.head], self.empty)
+        return (self.view[start + self.size:], self.view[:self.head])
+
+    def window_new (self) :
+        new_count = self.count - self.done_count
+        if new_count > self.size :
+            self.overruns += new_count - self.size
+        self.done_count = self.count
+        return self.window (new_count)
+
+    def window_stats (self, count) :
+        #---- (min, max, mean) of the last count samples, None if empty
+        first, second = self.window (count)
+        count = len (first) + len (second)
+        if count <= 0 :
+            return None
+        if self.np_buffer is not None :
+            dtype = self.np_buffer.dtype
+            parts = [numpy.frombuffer (part, dtype = dtype)
+                     for part in (first, second) if len (part) > 0]
+            return (min ([part.min () for part in parts]).item () ,
+                    max ([part.max () for part in parts]).item () ,
+                    sum ([part.sum (dtype = numpy.float64)
+                          for part in parts]).item () / count)
+        low = high = first[0]
+        total = 0
+        for part in (first, second) :
+            for value in part :
+                if value < low :
+                    low = value
+                if value > high :
+                    high = value
+                total += value
+        return (low, high, total / count)
+
+    def sample_count (self) :
+        return min (self.count, self.size)
+
+# end PollSampler
@@ -0,0 +1,360 @@
+#
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# poll_shard.py - Run PollLooper plugins in worker processes (python3 only)
+#
+# class PollShards
+#   methods:
+#     __init__
+#     poll_add - Add a plugin (class/factory) to a worker
+#     poll_start - Start the workers, relay messages until all have stopped
+#     shutdown - Stop all workers
+#     running - Returns True until shutdown
+#     poll_stats - Returns the aggregated worker timing statistics
+#
+# class PollShardBus - Worker plugin, message_data updates to/from PollShards
+#
+# class PollShardSender - Sends pipe messages on its own thread
+#
+################################################################################
+#
+
+import multiprocessing
+from multiprocessing.connection import wait
+import threading
+
+from poll_looper import PollLooper
+
+SHARD_CLOSE_WAIT_S = 5              # worker shutdown: queued messages sent
+
+#---------------------------------------------------------------------------
+# PollShardSender - Sends the messages of one pipe end on its own thread
+#   o send never blocks the poll loop (or the PollShards relay) when the
+#     other side is slow and the pipe is full
+#   o "set" messages of a mess_id still queued are merged (like
+#     message_set), the queue holds at most one per mess_id. Other
+#     messages are sent in order.
+#   o Send errors (other side gone) end the thread, later messages are
+#     dropped. drop: the conn is closed when the thread has ended.
+#---------------------------------------------------------------------------
+class PollShardSender :
+
+    def __init__ (self, conn) :
+        self.conn = conn
+        self.lock = threading.Condition ()
+        self.queue = []                 # messages waiting for the thread
+        self.pending = {}               # mess_id : queued "set" dict
+        self.closed = False
+        self.dropped = False            # close conn at the thread end
+        self.sending = True             # thread running
+        self.thread = threading.Thread (target = self.run)
+        self.thread.daemon = True
+        self.thread.start ()
+
+    def send (self, message) :
+        with self.lock :
+            if self.closed :
+                return
+            if message[0] == "set" :
+                mess_dict = self.pending.get (message[1])
+                if mess_dict is not None :
+                    mess_dict.update (message[2])   # not sent yet
+                    return
+                mess_dict = dict (message[2])
+                self.pending[message[1]] = mess_dict
+                message = ("set", message[1], mess_dict)
+            self.queue.append (message)
+            self.lock.notify ()
+
+    def run (self) :
+        while True :
+            with self.lock :
+                while not self.queue and not self.closed :
+                    self.lock.wait ()
+                if not self.queue :
+                    self.stopped ()     # closed, all sent
+                    return
+                message = self.queue.pop (0)
+                if message[0] == "set" :
+                    del self.pending[message[1]]
+            try :
+                self.conn.send (message)
+            except (EOFError, OSError) :
+                with self.lock :        # other side gone
+                    self.closed = True
+                    self.queue = []
+                    self.pending = {}
+                    self.stopped ()
+                return
+            except Exception as e :     # not picklable, nothing written
+                print ("PollShardSender:", message[0], "not sent")
+                print (e)
+
+    def stopped (self) :
+        #---- Thread end, lock held
+        self.sending = False
+        if self.dropped :
+            self.conn.close ()
+
+    def close (self, wait_s = None) :
+        #---- Sends the queued messages (up to wait_s), ends the thread
+        with self.lock :
+            self.closed = True
+            self.lock.notify ()
+        self.thread.join (wait_s)
+
+    def drop (self) :
+        #---- Other side done: the queued messages are not sent
+        with self.lock :
+            self.closed = True
+            self.dropped = True
+            self.queue = []
+            self.pending = {}
+            self.lock.notify ()
+            if not self.sending :
+                self.conn.close ()
+
+# end PollShardSender
+
+#---------------------------------------------------------------------------
+# PollShardBus - Worker side of the message bus
+#   o First plugin of each worker loop, applies the updates of the other
+#     workers before the plugins are polled
+#   o Sends the message_data changes of its worker (message_version)
+#   o The pipe is registered with io_register, updates and shutdown
+#     requests end the poll_wait sleep
+#   o Sent by a PollShardSender, poll_it doesn't block when PollShards
+#     is slow to read
+#---------------------------------------------------------------------------
+class PollShardBus :
+
+    def __init__ (self, poller, conn, shard, stats_ms = 1000) :
+        self.poller = poller
+        self.conn = conn
+        self.sender = PollShardSender (conn)
+        self.shard = shard
+        self.stats_ms = stats_ms
+        self.stats_last_ms = poller.get_current_time_ms ()
+        self.sent = {}                  # mess_id : message_version sent
+        self.stopping = False           # shutdown requested by PollShards
+
+    def poll_it (self) :
+        poller = self.poller
+        conn = self.conn
+        try :
+            while conn.poll () :
+                message = conn.recv ()
+                if message[0] == "set" :
+                    mess_id = message[1]
+                    unsent = self.sent.get (mess_id, 0) \
+                                != poller.message_version (mess_id)
+                    poller.message_set (mess_id, message[2])
+                    if not unsent :     # don't send the update back
+                        self.sent[mess_id] = poller.message_version (mess_id)
+                elif message[0] == "shutdown" :
+                    self.stopping = True
+                    poller.shutdown ()
+                elif message[0] == "stats" :
+                    self.send_stats ()
+        except (EOFError, OSError) :
+            self.stopping = True        # PollShards is gone
+            poller.shutdown ()
+            return
+        self.send_changes ()
+        if self.stats_ms > 0 and poller.poll_timing is not None \
+                and poller.elapsed_ms (self.stats_last_ms) >= self.stats_ms :
+            self.stats_last_ms = poller.get_current_time_ms ()
+            self.send_stats ()
+
+    def send_changes (self) :
+        poller = self.poller
+        sent = self.sent
+        versions = poller.message_versions
+        for mess_id in list (versions) :
+            version = versions[mess_id]
+            if sent.get (mess_id) != version :
+                sent[mess_id] = version
+                self.sender.send (("set", mess_id ,
+                                   poller.message_snapshot (mess_id)))
+
+    def send_stats (self) :
+        self.sender.send (("stats", self.shard, self.poller.poll_stats ()))
+
+    def shutdown (self) :
+        if not self.stopping :          # shutdown by a plugin of this worker
+            self.sender.send (("shutdown", self.shard))
+        self.send_changes ()
+        self.send_stats ()
+        self.sender.send (("done", self.shard))
+        self.sender.close (SHARD_CLOSE_WAIT_S)
+
+# end PollShardBus
+
+def poll_shard_worker (shard, conn, poll_ms, timing, stats_ms, specs) :
+    #---- Worker process: its own PollLooper with its share of the plugins
+    poller = PollLooper (poll_ms, timing = timing)
+    bus = PollShardBus (poller, conn, shard, stats_ms)
+    poller.poll_add (bus)
+    poller.io_register (bus, conn)
+    for factory, args, kwargs, poll_kwargs in specs :
+        poller.poll_add (factory (poller, *args, **kwargs), **poll_kwargs)
+    poller.poll_start ()
+
+#---------------------------------------------------------------------------
+# PollShards - Splits the plugins across worker processes
+#   o Each worker runs its own PollLooper, one core per worker
+#   o Plugins are given as class/factory and arguments, the plugin is
+#     created in the worker: factory (poller, *args, **kwargs)
+#   o message_data changes are relayed to all other workers (pipes),
+#     values must be picklable. A change reaches the other workers within
+#     about one poll cycle of each. Each worker has a PollShardSender, a
+#     slow worker doesn't stop the relay to the others.
+#   o shutdown of any worker (or PollShards shutdown) stops all workers
+#---------------------------------------------------------------------------
+class PollShards :
+
+    def __init__ (self ,
+                  poll_ms = 100 ,
+                  workers = None ,      # default: cpu count
+                  timing = False ,
+                  stats_ms = 1000) :    # worker stats interval (timing)
+        if workers is None :
+            workers = multiprocessing.cpu_count ()
+        self.poll_ms = poll_ms
+        self.workers = workers
+        self.timing = timing
+        self.stats_ms = stats_ms
+        self.specs = [[] for _ in range (workers)]
+        self.next_shard = 0             # round robin
+        self.conns = {}                 # live workers, conn : shard
+        self.senders = {}               # conn : PollShardSender
+        self.processes = []
+        self.message_data = {}          # latest data of all workers
+        self.shard_stats = {}           # shard : last poll_stats
+        self.states = {
+            'running' : True
+            }
+
+    def poll_add (self ,
+                  factory ,
+                  args = () ,
+                  kwargs = None ,
+                  shard = None ,        # default: round robin
+                  **poll_kwargs) :      # PollLooper poll_add parameters
+        if shard is None :
+            shard = self.next_shard
+            self.next_shard = (self.next_shard + 1) % self.workers
+        if kwargs is None :
+            kwargs = {}
+        self.specs[shard].append ((factory, args, kwargs, poll_kwargs))
+        return shard
+
+    def poll_start (self) :
+        for shard in range (self.workers) :
+            conn, worker_conn = multiprocessing.Pipe ()
+            process = multiprocessing.Process (target = poll_shard_worker ,
+                                               args = (shard ,
+                                                       worker_conn ,
+                                                       self.poll_ms ,
+                                                       self.timing ,
+                                                       self.stats_ms ,
+                                                       self.specs[shard]))
+            process.start ()
+            worker_conn.close ()
+            self.conns[conn] = shard
+            self.senders[conn] = PollShardSender (conn)
+            self.processes.append (process)
+        while self.conns :
+            try :
+                for conn in wait (list (self.conns), 1.0) :
+                    self.relay (conn)
+            except KeyboardInterrupt :
+                self.shutdown ()
+        for process in self.processes :
+            process.join ()
+        print ("Poll shards completed")
+
+    def relay (self, conn) :
+        try :
+            message = conn.recv ()
+        except (EOFError, OSError) :
+            del self.conns[conn]        # worker ended
+            self.senders.pop (conn).drop ()
+            self.shutdown ()
+            return
+        if message[0] == "set" :
+            mess_id = message[1]
+            if mess_id in self.message_data :   # merge like message_set
+                self.message_data[mess_id].update (message[2])
+            else :
+                self.message_data[mess_id] = message[2]
+            for other in self.conns :
+                if other is not conn :
+                    self.send (other, message)
+        elif message[0] == "stats" :
+            self.shard_stats[message[1]] = message[2]
+        elif message[0] == "shutdown" :
+            self.shutdown ()
+        elif message[0] == "done" :
+            del self.conns[conn]
+            self.senders.pop (conn).drop ()     # closes conn
+
+    def send (self, conn, message) :
+        self.senders[conn].send (message)   # doesn't block, see relay
+
+    def shutdown (self) :
+        if not self.states['running'] :
+            return
+        print ("Shutdown requested")
+        self.states['running'] = False
+        for conn in self.conns :
+            self.send (conn, ("shutdown",))
+
+    def running (self) :
+        return self.states['running']
+
+    def poll_stats (self) :
+        #---- Totals of the last worker stats, plugins with their shard
+        shards = []
+        plugins = []
+        stats = {"cycles" : 0 ,
+                 "overruns" : 0 ,
+                 "missed_cycles" : 0 ,
+                 "shards" : shards ,
+                 "plugins" : plugins}
+        for shard in sorted (self.shard_stats) :
+            shard_stats = self.shard_stats[shard]
+            if shard_stats is None :
+                continue                # timing not enabled
+            shards.append (shard_stats)
+            for key in ("cycles", "overruns", "missed_cycles") :
+                stats[key] += shard_stats[key]
+            for plugin in shard_stats["plugins"] :
+                plugin = dict (plugin)
+                plugin["shard"] = shard
+                plugins.append (plugin)
+        return stats
+
+# end PollShards
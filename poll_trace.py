@@ -0,0 +1,151 @@
+#
+################################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2022 Curt Timmerman
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+#
+# poll_trace.py - Convert a PollTracer trace file (python3)
+#
+#   python3 poll_trace.py trace.bin                  timeline to stdout
+#   python3 poll_trace.py trace.bin -o trace.json    Chrome trace JSON
+#
+# Chrome trace JSON: open in chrome://tracing or https://ui.perfetto.dev
+#
+################################################################################
+#
+
+import argparse
+import json
+import struct
+
+from poll_looper import TRACE_MAGIC, TRACE_HEADER, TRACE_HEADER_SIZE ,\
+                        TRACE_RECORD, TRACE_RECORD_SIZE, TRACE_NO_PLUGIN ,\
+                        TRACE_CYCLE_START, TRACE_CYCLE_END, TRACE_ENTER ,\
+                        TRACE_EXIT, TRACE_SLEEP, TRACE_WAKE, TRACE_OVERRUN
+
+EVENT_NAMES = {TRACE_CYCLE_START : "cycle_start" ,
+               TRACE_CYCLE_END : "cycle_end" ,
+               TRACE_ENTER : "enter" ,
+               TRACE_EXIT : "exit" ,
+               TRACE_SLEEP : "sleep" ,
+               TRACE_WAKE : "wake" ,
+               TRACE_OVERRUN : "overrun"}
+
+def read_trace (path) :
+    #---- Returns ([(time_us, event, order, value), ...], plugin names),
+    #---- oldest record first, time_us from the oldest record
+    with open (path, "rb") as trace_file :
+        data = trace_file.read ()
+    magic, version, record_size, records, count \
+        = struct.unpack_from (TRACE_HEADER, data, 0)
+    if magic != TRACE_MAGIC or record_size != TRACE_RECORD_SIZE :
+        raise ValueError ("not a poll_looper trace: " + path)
+    names_offset = TRACE_HEADER_SIZE + records * record_size
+    names = data[names_offset:].decode ().split ("\n")[:-1]
+    if count > records :
+        first = count % records
+        indexes = list (range (first, records)) + list (range (first))
+    else :
+        indexes = range (count)
+    events = []
+    time_us = 0
+    for index in indexes :
+        delta_us, event, order, value \
+            = struct.unpack_from (TRACE_RECORD, data ,
+                                  TRACE_HEADER_SIZE + index * record_size)
+        if events :
+            time_us += delta_us         # oldest: its delta base is lost
+        events.append ((time_us, event, order, value))
+    return (events, names)
+
+def plugin_name (names, order) :
+    if order == TRACE_NO_PLUGIN :
+        return ""
+    if order < len (names) and names[order] :
+        return names[order]
+    return "plugin " + str (order)
+
+def timeline (events, names) :
+    lines = []
+    for time_us, event, order, value in events :
+        lines.append ("%12d us  %-12s %-24s %d"
+                        % (time_us, EVENT_NAMES.get (event, str (event)) ,
+                           plugin_name (names, order), value))
+    return lines
+
+def chrome_trace (events, names) :
+    #---- Complete ("X") events: cycles, plugins (nested), sleeps
+    trace_events = []
+    cycle_us = None
+    sleep_us = None
+    def complete (name, start_us, end_us, args = None) :
+        trace_event = {"name" : name ,
+                       "ph" : "X" ,
+                       "ts" : start_us ,
+                       "dur" : end_us - start_us ,
+                       "pid" : 1 ,
+                       "tid" : 1}
+        if args :
+            trace_event["args"] = args
+        trace_events.append (trace_event)
+    for time_us, event, order, value in events :
+        if sleep_us is not None \
+                and event in (TRACE_WAKE, TRACE_CYCLE_START) :
+            complete ("sleep", sleep_us, time_us)
+            sleep_us = None
+        if event == TRACE_CYCLE_START :
+            cycle_us = time_us
+        elif event == TRACE_CYCLE_END :
+            if cycle_us is not None :
+                complete ("cycle", cycle_us, time_us)
+            cycle_us = None
+        elif event == TRACE_EXIT :
+            complete (plugin_name (names, order), time_us - value, time_us)
+        elif event == TRACE_SLEEP :
+            sleep_us = time_us
+        elif event == TRACE_OVERRUN :
+            trace_events.append ({"name" : "overrun" ,
+                                  "ph" : "i" ,
+                                  "s" : "t" ,
+                                  "ts" : time_us ,
+                                  "pid" : 1 ,
+                                  "tid" : 1 ,
+                                  "args" : {"late_us" : value}})
+    return {"traceEvents" : trace_events ,
+            "displayTimeUnit" : "ms"}
+
+def main () :
+    parser = argparse.ArgumentParser (description = "Convert a PollLooper trace")
+    parser.add_argument ("trace", help = "trace file (trace_enable path)")
+    parser.add_argument ("-o", "--output" ,
+                         help = "Chrome trace JSON file, default: timeline")
+    args = parser.parse_args ()
+    events, names = read_trace (args.trace)
+    if args.output is None :
+        for line in timeline (events, names) :
+            print (line)
+    else :
+        with open (args.output, "w") as output :
+            json.dump (chrome_trace (events, names), output)
+
+if __name__ == "__main__" :
+    main ()